@@ -0,0 +1,414 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Benchmarks of django_db_utils hot paths.
+
+Benchmarks run on in-memory SQLite database, unless Django settings are
+already configured::
+
+    python -m django_db_utils.benchmark --sizes 1000,10000 -o bench.json
+
+Results are written as JSON list of records with ``name``, ``params``,
+``count`` (how many items were processed), ``seconds`` and
+``us_per_item`` keys, so they can be compared between releases.
+"""
+
+
+import argparse
+import json
+import random
+import sys
+import time
+
+from django.conf import settings
+
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+WRITER_TYPES = ('csv', 'tsv', 'xls', 'ods')
+
+
+def setup():
+    """ Configures Django for benchmarks.
+    """
+
+    if not settings.configured:
+        settings.configure(
+                DATABASES={
+                    'default': {
+                        'ENGINE': 'django.db.backends.sqlite3',
+                        'NAME': ':memory:',
+                        },
+                    },
+                INSTALLED_APPS=('django_db_utils',),
+                )
+
+
+def create_model(name, fields):
+    """ Creates model class ``name`` with ``fields`` and its table.
+    """
+
+    from django.core.management.color import no_style
+    from django.db import connection, models
+
+    attrs = dict(fields)
+    attrs['__module__'] = 'django_db_utils.models'
+    model = type(name, (models.Model,), attrs)
+    sql, references = connection.creation.sql_create_model(model, no_style())
+    cursor = connection.cursor()
+    for statement in sql:
+        cursor.execute(statement)
+    for statement in connection.creation.sql_indexes_for_model(
+            model, no_style()):
+        cursor.execute(statement)
+    return model
+
+
+def measure(function, *args, **kwargs):
+    """ Returns how many seconds call of ``function`` took.
+    """
+
+    start = time.time()
+    function(*args, **kwargs)
+    return time.time() - start
+
+
+def record(name, params, count, seconds):
+    """ Creates benchmark result record.
+    """
+
+    return {
+            'name': name,
+            'params': params,
+            'count': count,
+            'seconds': seconds,
+            'us_per_item': seconds / count * 1e6 if count else None,
+            }
+
+
+def create_export_models():
+    """ Creates synthetic models, which use every field type of
+    :mod:`django_db_utils.models`.
+
+    :returns: ``(Person, Address, Phone)``.
+    """
+
+    from django.db import models
+    from django_db_utils import models as db_models
+
+    person = create_model('BenchmarkPerson', {
+        'first_name': db_models.FirstNameField(),
+        'last_name': db_models.LastNameField(),
+        'identity_code': db_models.IdentityCodeField(),
+        'uuid': db_models.UUIDField(),
+        'compact_uuid': db_models.CompactUUIDField(),
+        'phone_number': db_models.PhoneNumberField(),
+        'gender': models.CharField(
+            max_length=1, choices=((u'M', u'Male'), (u'F', u'Female'))),
+        })
+    address = create_model('BenchmarkAddress', {
+        'person': models.OneToOneField(person),
+        'city': models.CharField(max_length=45),
+        'postal_number': db_models.PostalNumberField(),
+        })
+    phone = create_model('BenchmarkPhone', {
+        'person': models.ForeignKey(person),
+        'number': db_models.PhoneNumberField(),
+        })
+    return person, address, phone
+
+
+def populate(person, address, phone, count):
+    """ Inserts ``count`` persons, address for every second of them and
+    two phones for everyone.
+    """
+
+    from django.db import transaction
+    from django_db_utils.models import bulk_create
+
+    names = NAME_CORPORA['lithuanian']
+    with transaction.commit_on_success():
+        for start in range(0, count, 1000):
+            persons = [
+                    person(
+                        id=index + 1,
+                        first_name=names[index % len(names)],
+                        last_name=names[-index % len(names)],
+                        identity_code=u'38703181745',
+                        phone_number=u'+37061234567',
+                        gender=(u'M', u'F')[index % 2])
+                    for index in range(start, min(start + 1000, count))]
+            bulk_create(person, persons)
+            address.objects.bulk_create([
+                address(
+                    person_id=obj.id, city=u'Vilnius',
+                    postal_number=u'01234')
+                for obj in persons if obj.id % 2])
+            phone.objects.bulk_create([
+                phone(person_id=obj.id, number=number)
+                for obj in persons
+                for number in (u'+37061234567', u'+37052345678')])
+
+
+def download(queryset, writer_type, stream):
+    """ Generates download response and consumes its content.
+    """
+
+    from django_db_utils.utils import download_query
+
+    response = download_query(queryset, writer_type, stream=stream)
+    # Before Django 1.5 streamed content is iterated from response.
+    for data in getattr(response, 'streaming_content', response):
+        pass
+
+
+def bench_exports(sizes=DEFAULT_SIZES):
+    """ Measures :func:`~django_db_utils.utils.dump_query_to_sheet` with
+    and without merge and join rules and
+    :func:`~django_db_utils.utils.download_query` for every writer type.
+
+    ``CompactUUIDField`` values must be converted by the field, so the
+    ``flat_values`` variant excludes it to measure export of plain
+    database values.
+    """
+
+    from django_db_utils.utils import dump_query_to_sheet
+
+    person, address, phone = create_export_models()
+    populate(person, address, phone, max(sizes))
+    address_name = address._meta.app_label + ':' + address._meta.module_name
+    phone_name = phone._meta.app_label + ':' + phone._meta.module_name
+    variants = (
+            ('flat', {}),
+            ('flat_values', {'exclude': ('compact_uuid',)}),
+            ('merge', {'merge_rules': (address_name,)}),
+            ('join', {'join_rules': (('number', phone_name, ({}, {})),)}),
+            ('merge_join', {
+                'merge_rules': (address_name,),
+                'join_rules': (('number', phone_name, ({}, {})),),
+                }),
+            )
+
+    results = []
+    for size in sizes:
+        queryset = person.objects.filter(id__lte=size)
+        for variant, kwargs in variants:
+            results.append(record(
+                'dump_query_to_sheet', {'size': size, 'variant': variant},
+                size, measure(dump_query_to_sheet, queryset, **kwargs)))
+        for writer_type in WRITER_TYPES:
+            for stream in (False, True):
+                try:
+                    seconds = measure(download, queryset, writer_type, stream)
+                except KeyError:
+                    # Writer is not installed or cannot stream.
+                    continue
+                results.append(record(
+                    'download_query',
+                    {'size': size, 'writer': writer_type, 'stream': stream},
+                    size, seconds))
+    return results
+
+
+def bench_uuid_inserts(count=10000):
+    """ Compares insert throughput of random and time ordered UUIDs.
+    """
+
+    from django.db import transaction
+    from django_db_utils.models import UUIDField, time_ordered_uuid, uuid
+
+    def insert(model):
+        """ Inserts ``count`` objects one by one.
+        """
+        with transaction.commit_on_success():
+            for i in range(count):
+                model().save()
+
+    results = []
+    for name, generator in (
+            ('random', uuid), ('time_ordered', time_ordered_uuid)):
+        model = create_model(
+                'UUIDBenchmark{0}'.format(name.title().replace('_', '')),
+                {'uuid': UUIDField(generator=generator)})
+        results.append(record(
+            'uuid_insert', {'generator': name},
+            count, measure(insert, model)))
+    return results
+
+
+NAME_CORPORA = {
+        'lithuanian': [
+            u'Jonas', u'Petras', u'Ąžuolas', u'Vytautas', u'Rūta',
+            u'Eglė', u'Žydrūnas', u'Šarūnas', u'Gintarė', u'Aušra',
+            u'Jonaitis', u'Petrauskas', u'Kazlauskienė', u'Žukauskas',
+            u'Stankevičius', u'Vasiliauskaitė', u'Butkutė-Navickienė',
+            ],
+        'german': [
+            u'Jürgen', u'Günther', u'Jörg', u'Käthe', u'Wolfgang',
+            u'Max', u'Grüße', u'Müller', u'Schröder', u'Weiß',
+            u'Schäfer', u'Köhler', u'Zimmermann', u'Walter-Quast',
+            ],
+        }
+
+
+def repeat(values, count):
+    """ Returns list of ``count`` items, repeating ``values``.
+    """
+
+    return (values * (count // len(values) + 1))[:count]
+
+
+def bench_name_validation(count=100000):
+    """ Compares cost of name validation with tuple alphabet and with
+    :class:`~django_db_utils.validators.Alphabet`.
+    """
+
+    from django.core.exceptions import ValidationError
+    from django_db_utils.validators import (
+            NamesValidator, EXTENDED_ALPHABET)
+
+    def validate(validator, values):
+        """ Validates all values.
+        """
+        for value in values:
+            try:
+                validator(value)
+            except ValidationError:
+                pass
+
+    results = []
+    for corpus, names in NAME_CORPORA.items():
+        values = repeat(names, count)
+        for alphabet_name, alphabet in (
+                ('tuple', tuple(EXTENDED_ALPHABET)),
+                ('set', EXTENDED_ALPHABET)):
+            validator = NamesValidator(
+                    alphabet, validation_exception_type=ValidationError)
+            results.append(record(
+                'name_validation',
+                {'corpus': corpus, 'alphabet': alphabet_name},
+                count, measure(validate, validator, values)))
+    return results
+
+
+def random_names(rng, names, count, invalid=0.05):
+    """ Generates ``count`` (mostly distinct) names from letters of
+    ``names``; share ``invalid`` of them contains a digit.
+    """
+
+    letters = sorted(set(u''.join(names).lower()).difference(u'-'))
+    values = []
+    for i in range(count):
+        name = u''.join([
+            rng.choice(letters) for j in range(rng.randint(4, 12))])
+        if rng.random() < invalid:
+            name += rng.choice(u'0123456789')
+        values.append(name.title())
+    return values
+
+
+def random_identity_codes(rng, count, invalid=0.05):
+    """ Generates ``count`` identity codes; share ``invalid`` of them
+    has wrong checksum.
+    """
+
+    from django_db_utils.identity_codes import checksum
+
+    values = []
+    for i in range(count):
+        digits = [rng.randint(3, 6)] + [
+                int(char) for char in u'{0:02d}{1:02d}{2:02d}{3:03d}'.format(
+                    rng.randint(0, 99), rng.randint(1, 12),
+                    rng.randint(1, 28), rng.randint(0, 999))]
+        control = checksum(digits)
+        if rng.random() < invalid:
+            control = (control + 1) % 10
+        values.append(u''.join(map(unicode, digits + [control])))
+    return values
+
+
+def random_phone_numbers(rng, count, invalid=0.05):
+    """ Generates ``count`` mobile phone numbers in international and
+    local formats; share ``invalid`` of them is too short.
+    """
+
+    values = []
+    for i in range(count):
+        number = u'{0:07d}'.format(rng.randint(0, 9999999))
+        if rng.random() < invalid:
+            number = number[:4]
+        values.append(rng.choice((u'+3706', u'86')) + number)
+    return values
+
+
+def bench_form_fields(count=100000, seed=0):
+    """ Measures per value ``clean`` and bulk ``validate_many`` of every
+    form field.
+
+    Values are random, so they are almost all distinct, like in real
+    imports. Phone number cache is cleared before every measurement.
+    """
+
+    from django.core.exceptions import ValidationError
+    from django_db_utils import forms
+    from django_db_utils.validators import phone_number_cache
+
+    rng = random.Random(seed)
+    samples = (
+            (forms.FirstNameField,
+             random_names(rng, NAME_CORPORA['lithuanian'], count)),
+            (forms.LastNameField,
+             random_names(rng, NAME_CORPORA['german'], count)),
+            (forms.IdentityCodeField, random_identity_codes(rng, count)),
+            (forms.PhoneNumberField, random_phone_numbers(rng, count)),
+            )
+
+    def clean_each(field, values):
+        """ Cleans values one by one.
+        """
+        for value in values:
+            try:
+                field.clean(value)
+            except ValidationError:
+                pass
+
+    results = []
+    for field_class, values in samples:
+        field = field_class()
+        phone_number_cache.clear()
+        results.append(record(
+            'form_field_clean', {'field': field_class.__name__},
+            count, measure(clean_each, field, values)))
+        phone_number_cache.clear()
+        results.append(record(
+            'form_field_validate_many', {'field': field_class.__name__},
+            count, measure(field.validate_many, values)))
+    return results
+
+
+def main(argv=None):
+    """ Runs benchmarks and writes results as JSON.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+            '--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+            help='comma separated export sizes (rows)')
+    parser.add_argument(
+            '-o', '--output', help='file for JSON results (default stdout)')
+    args = parser.parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    setup()
+    results = (
+            bench_exports(sizes) +
+            bench_uuid_inserts() +
+            bench_name_validation() +
+            bench_form_fields())
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+""" Cache of exported files.
+"""
+
+
+import errno
+import os
+import tempfile
+from uuid import uuid4
+
+from django.db.models import signals
+
+
+class FileExportCache(object):
+    """ Stores exported files in ``directory``.
+
+    When total size of cached files exceeds ``max_size`` bytes, the least
+    recently used files are removed. Every watched model has a version
+    file, which is changed on ``post_save`` and ``post_delete``; versions
+    are part of cache keys, so stale files are never served and are
+    removed by size eviction. Because everything is kept on disk, the
+    cache can be shared by several processes.
+
+    Every process, which changes data of exported models (web workers,
+    admin, cron jobs), must create the cache with these ``models``
+    (for example, at module level of an application), so their changes
+    invalidate cached files even if the process never exports.
+    """
+
+    def __init__(self, directory, max_size=100 * 1024 * 1024, models=()):
+        self.directory = directory
+        self.max_size = max_size
+        self.files_directory = os.path.join(directory, 'files')
+        self.versions_directory = os.path.join(directory, 'versions')
+        for path in (self.files_directory, self.versions_directory):
+            try:
+                os.makedirs(path)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        self.watch(*models)
+
+    def _version_path(self, model):
+        """ Returns path of ``model`` version file.
+        """
+        return os.path.join(
+                self.versions_directory,
+                '{0}.{1}'.format(model._meta.app_label,
+                                 model._meta.object_name))
+
+    def model_version(self, model):
+        """ Returns current version of ``model`` data.
+        """
+        try:
+            with open(self._version_path(model)) as version_file:
+                return version_file.read()
+        except IOError:
+            return ''
+
+    def invalidate(self, sender, **kwargs):
+        """ Changes version of ``sender`` model, so files exported with
+        its data are not served any more.
+        """
+        self._write(self._version_path(sender), uuid4().hex)
+
+    def watch(self, *models):
+        """ Connects ``models`` signals to :meth:`invalidate`.
+
+        Models are watched automatically when they are exported and
+        when they are passed to constructor. Only one receiver per cache
+        directory is connected, however many instances watch it.
+        """
+        for model in models:
+            for signal in (signals.post_save, signals.post_delete):
+                signal.connect(
+                        self.invalidate, sender=model, weak=False,
+                        dispatch_uid=(
+                            'django_db_utils.export_cache',
+                            os.path.abspath(self.directory), model))
+
+    def _write(self, path, data):
+        """ Atomically writes ``data`` to file ``path``.
+        """
+        descriptor, temp_path = tempfile.mkstemp(
+                prefix='.', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(descriptor, 'wb') as temp_file:
+                temp_file.write(data)
+            os.rename(temp_path, path)
+        except:
+            os.remove(temp_path)
+            raise
+
+    def get(self, key):
+        """ Returns cached file content or None.
+        """
+        path = os.path.join(self.files_directory, key)
+        try:
+            with open(path, 'rb') as cached_file:
+                data = cached_file.read()
+        except IOError:
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return data
+
+    def set(self, key, data):
+        """ Stores file content and evicts old files, if needed.
+        """
+        if len(data) > self.max_size:
+            return
+        self._write(os.path.join(self.files_directory, key), data)
+        self.evict()
+
+    def evict(self):
+        """ Removes least recently used files, until their total size is
+        not bigger than ``max_size``.
+        """
+        files = []
+        total_size = 0
+        for name in os.listdir(self.files_directory):
+            if name.startswith('.'):
+                continue
+            path = os.path.join(self.files_directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+        files.sort()
+        for mtime, size, path in files:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
@@ -1,30 +1,137 @@
 # -*- coding: utf-8 -*-
 
+import collections
+
 from django.core.exceptions import ValidationError
 from django import forms
 from django.utils.translation import ugettext_lazy as _
 
-#from pysheets.spreadsheet import SpreadSheet
-#from pysheets.sheet import Sheet
-#from pysheets.readers import SheetReader, SpreadSheetReader
+from django_db_utils.validators import (
+        NamesValidator, SurnameValidator, IdentityCodeValidator,
+        EXTENDED_ALPHABET, EXTENDED_LETTERS, foreign_letters, get_validator,
+        CachedValidator, phone_number_cache, ValidatedIdentityCode)
+from django_db_utils.importer import get_reader
+
+
+class BulkValidationMixin(object):
+    """ Adds :meth:`validate_many` to form field.
+    """
+
+    def screen_many(self, values):
+        """ Finds values, which are invalid without running validator.
+
+        :returns:
+            dictionary, which maps invalid value to reason key. Values
+            with the same reason key must get the same error messages
+            from :meth:`clean`.
+        """
+
+        return {}
+
+    def accept_many(self, values):
+        """ Finds values, which are valid without running validator.
+
+        :returns: dictionary, which maps value to cleaned value.
+        """
+
+        return {}
+
+    def clean_result(self, value):
+        """ Returns ``(cleaned value, None)`` or ``(None, errors)``.
+        """
+
+        try:
+            return self.clean(value), None
+        except ValidationError as e:
+            return None, e.messages
+
+    def validate_many(self, values):
+        """ Cleans many values at once.
 
-from db_utils.validators.name import (
-        NamesValidator, SurnameValidator, ALPHABET_LT)
-from db_utils.validators.phone_number import PhoneNumberValidator
-from db_utils.validators.identity_code import IdentityCodeValidator
+        Equal values are cleaned only once. Values accepted by
+        :meth:`accept_many` are not cleaned again. Of values rejected by
+        :meth:`screen_many` for the same reason only one is cleaned, and
+        its errors are reused for the others without raising exceptions
+        (unless errors mention the cleaned value itself).
 
+        :returns:
+            ``(cleaned, errors)``, where ``cleaned`` is a list of cleaned
+            values (None for invalid ones) and ``errors`` is a dictionary,
+            which maps index of invalid value to list of error messages.
+        """
+
+        values = list(values)
+        distinct = set(values)
+        results = dict([
+            (value, (cleaned, None))
+            for value, cleaned in self.accept_many(distinct).items()])
+        groups = collections.defaultdict(list)
+        for value, reason in self.screen_many(
+                distinct.difference(results)).items():
+            groups[reason].append(value)
+        for group in groups.values():
+            group.sort()
+            result = self.clean_result(group[0])
+            results[group[0]] = result
+            if result[1] is None or [
+                    message for message in result[1]
+                    if group[0] in unicode(message)]:
+                continue
+            for value in group[1:]:
+                results[value] = result
+        cleaned = []
+        errors = {}
+        for index, value in enumerate(values):
+            try:
+                result = results[value]
+            except KeyError:
+                result = self.clean_result(value)
+                results[value] = result
+            cleaned.append(result[0])
+            if result[1] is not None:
+                errors[index] = result[1]
+        return cleaned, errors
+
+
+class NameBulkValidationMixin(BulkValidationMixin):
+    """ Bulk validation for names, written in ``EXTENDED_ALPHABET``.
+    """
+
+    letters = EXTENDED_LETTERS
 
-EXTENDED_ALPHABET = ALPHABET_LT + (u'x', u'w', u'q', u'ä', u'ü', u'ö', u'ß')
+    def screen_many(self, values):
+        """ Rejects values with letters, which are not in alphabet.
 
+        All values are scanned for foreign letters in one pass. Reason
+        is the set of foreign letters together with length checks of
+        the field, which :meth:`clean` runs before validator.
+        """
 
-class FirstNameField(forms.CharField):
+        values = [value for value in values if isinstance(value, unicode)]
+        foreign = foreign_letters(u''.join(values), self.letters)
+        if not foreign:
+            return {}
+        screened = {}
+        for value in values:
+            letters = foreign.intersection(value)
+            if letters:
+                screened[value] = (
+                        frozenset(letters),
+                        self.max_length is not None and
+                        len(value) > self.max_length,
+                        self.min_length is not None and
+                        len(value) < self.min_length)
+        return screened
+
+
+class FirstNameField(NameBulkValidationMixin, forms.CharField):
     """ Form field for first name.
     """
 
     def __init__(self, *args, **kwargs):
         super(FirstNameField, self).__init__(*args, **kwargs)
-        self._validator = NamesValidator(
-                EXTENDED_ALPHABET,
+        self._validator = get_validator(
+                NamesValidator, EXTENDED_ALPHABET,
                 validation_exception_type=ValidationError,
                 )
 
@@ -39,14 +146,14 @@ class FirstNameField(forms.CharField):
             return self._validator(value)
 
 
-class LastNameField(forms.CharField):
+class LastNameField(NameBulkValidationMixin, forms.CharField):
     """ Form field for last name.
     """
 
     def __init__(self, *args, **kwargs):
         super(LastNameField, self).__init__(*args, **kwargs)
-        self._validator = SurnameValidator(
-                EXTENDED_ALPHABET,
+        self._validator = get_validator(
+                SurnameValidator, EXTENDED_ALPHABET,
                 validation_exception_type=ValidationError,
                 )
 
@@ -61,13 +168,14 @@ class LastNameField(forms.CharField):
             return self._validator(value)
 
 
-class IdentityCodeField(forms.CharField):
+class IdentityCodeField(BulkValidationMixin, forms.CharField):
     """ Form field for last name.
     """
 
     def __init__(self, *args, **kwargs):
         super(IdentityCodeField, self).__init__(*args, **kwargs)
-        self._validator = IdentityCodeValidator(
+        self._validator = get_validator(
+                IdentityCodeValidator,
                 validation_exception_type=ValidationError,
                 )
 
@@ -79,20 +187,31 @@ class IdentityCodeField(forms.CharField):
         if not value and not self.required:
             return None
         else:
-            return unicode(self._validator(value))
+            return ValidatedIdentityCode(self._validator(value))
+
+    def accept_many(self, values):
+        """ Accepts valid identity codes, which are checked all at once
+        with :func:`~django_db_utils.identity_codes.check_many`.
+        """
+
+        # NumPy (if installed) is loaded only for bulk checking.
+        from django_db_utils.identity_codes import check_many
 
+        values = [value for value in values if isinstance(value, unicode)]
+        valid = check_many(values)[0]
+        return dict([
+            (value, ValidatedIdentityCode(value))
+            for value, is_valid in zip(values, valid) if is_valid])
 
-class PhoneNumberField(forms.CharField):
+
+class PhoneNumberField(BulkValidationMixin, forms.CharField):
     """ Form field for phone number.
     """
 
     def __init__(self, *args, **kwargs):
         kwargs['initial'] = kwargs.get('initial', u'+370')
         super(PhoneNumberField, self).__init__(*args, **kwargs)
-        self._validator = PhoneNumberValidator(
-                u'370',
-                validation_exception_type=ValidationError,
-                )
+        self._validator = get_validator(CachedValidator, phone_number_cache)
 
     def clean(self, value):
         """ Cleans value, to contain Unicode string with phone number
@@ -109,97 +228,22 @@ class PhoneNumberField(forms.CharField):
             return self._validator(value)
 
 
-#class SheetField(forms.FileField):
-    #""" Form field for sheet.
-    #"""
-
-    #def __init__(
-            #self, sheet_name_column=_(u'Sheet'),
-            #sheet_constructor_args=None,
-            #spreadsheet_constructor_args=None,
-            #*args, **kwargs):
-        #super(SheetField, self).__init__(*args, **kwargs)
-        #self.sheet_name_column = sheet_name_column
-        #self.sheet_constructor_args = sheet_constructor_args or {}
-        #self.spreadsheet_constructor_args = (
-                #spreadsheet_constructor_args or {})
-
-    #def clean(self, value, initial):
-        #""" Cleans value to contain Sheet.
-        #"""
-
-        #value = super(SheetField, self).clean(value, initial)
-        #try:
-            #reader = SpreadSheetReader.plugins.get_by_file(value.name)
-        #except KeyError:
-            #try:
-                #reader = SheetReader.plugins.get_by_file(value.name)
-            #except KeyError:
-                #raise forms.ValidationError(
-                        #_(u'Failed to recognize file type.'))
-            #else:
-                #sheet = Sheet(
-                        #value, reader=reader(),
-                        #**self.sheet_constructor_args)
-                #return sheet
-        #else:
-            #spreadsheet = SpreadSheet(
-                    #value, reader=reader(),
-                    #**self.spreadsheet_constructor_args)
-            #return spreadsheet.join(self.sheet_name_column)
-
-
-#class SpreadSheetField(forms.FileField):
-    #""" Form field for spreadsheet.
-    #"""
-
-    #def __init__(
-            #self, sheet_name=_(u'Sheet'),
-            #sheet_constructor_args=None,
-            #spreadsheet_constructor_args=None,
-            #*args, **kwargs):
-        #super(SpreadSheetField, self).__init__(*args, **kwargs)
-        #self.sheet_name = sheet_name
-        #self.sheet_constructor_args = sheet_constructor_args or {}
-        #self.spreadsheet_constructor_args = (
-                #spreadsheet_constructor_args or {})
-
-    #def clean(self, value, initial):
-        #""" Cleans value to contain Sheet.
-        #"""
-
-        #value = super(SpreadSheetField, self).clean(value, initial)
-        #try:
-            #reader = SpreadSheetReader.plugins.get_by_file(value.name)
-        #except KeyError:
-            #try:
-                #reader = SheetReader.plugins.get_by_file(value.name)
-            #except KeyError:
-                #raise forms.ValidationError(
-                        #_(u'Failed to recognize file type.'))
-            #else:
-                #try:
-                    #sheet = Sheet(
-                            #value, reader=reader(),
-                            #**self.sheet_constructor_args)
-                #except forms.ValidationError:
-                    #raise
-                #except Exception as e:
-                    #raise forms.ValidationError(
-                            #_(u'Error occured while reading: {0}'
-                                #).format(e))
-                #spreadsheet = SpreadSheet()
-                #spreadsheet.load(sheet, name=self.sheet_name)
-                #return spreadsheet
-        #else:
-            #try:
-                #spreadsheet = SpreadSheet(
-                        #value, reader=reader(),
-                        #**self.spreadsheet_constructor_args)
-            #except forms.ValidationError:
-                #raise
-            #except Exception as e:
-                #raise forms.ValidationError(
-                        #_(u'Error occured while reading: {0}'
-                            #).format(e))
-            #return spreadsheet
+class ImportFileField(forms.FileField):
+    """ Form field for uploaded sheet, which is imported with
+    :func:`django_db_utils.importer.import_file`.
+
+    File is not read while cleaning, only its type is checked.
+    """
+
+    def clean(self, value, initial=None):
+        """ Cleans value to contain uploaded file of recognized type.
+        """
+
+        value = super(ImportFileField, self).clean(value, initial)
+        if value:
+            try:
+                get_reader(value.name)
+            except KeyError:
+                raise forms.ValidationError(
+                        _(u'Failed to recognize file type.'))
+        return value
@@ -0,0 +1,130 @@
+""" Bulk checking of Lithuanian identity codes.
+
+Identity code has form ``GYYMMDDNNNC``, where ``G`` encodes century and
+gender, ``YYMMDD`` is birth date, ``NNN`` is a serial number and ``C`` is
+a checksum digit.
+"""
+
+
+import datetime
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+MALE = u'M'
+FEMALE = u'F'
+
+FIRST_WEIGHTS = (1, 2, 3, 4, 5, 6, 7, 8, 9, 1)
+SECOND_WEIGHTS = (3, 4, 5, 6, 7, 8, 9, 1, 2, 3)
+
+
+def checksum(digits):
+    """ Computes checksum digit from the first 10 ``digits``.
+    """
+
+    remainder = sum([
+        digit * weight for digit, weight in zip(digits, FIRST_WEIGHTS)]) % 11
+    if remainder != 10:
+        return remainder
+    remainder = sum([
+        digit * weight for digit, weight in zip(digits, SECOND_WEIGHTS)]) % 11
+    if remainder != 10:
+        return remainder
+    return 0
+
+
+def decode(code):
+    """ Decodes one identity code.
+
+    :returns:
+        ``(birth_date, gender)`` or None, if ``code`` is invalid.
+    """
+
+    if len(code) != 11 or not all([u'0' <= char <= u'9' for char in code]):
+        return None
+    digits = [int(char) for char in code]
+    if not 1 <= digits[0] <= 6 or checksum(digits) != digits[10]:
+        return None
+    century = 1800 + 100 * ((digits[0] - 1) // 2)
+    try:
+        birth_date = datetime.date(
+                century + int(code[1:3]), int(code[3:5]), int(code[5:7]))
+    except ValueError:
+        return None
+    return birth_date, (MALE if digits[0] % 2 else FEMALE)
+
+
+def _check_many_numpy(codes):
+    """ :func:`check_many` implementation with NumPy arrays.
+    """
+
+    valid = numpy.zeros(len(codes), dtype=bool)
+    well_formed = numpy.array([
+        len(code) == 11 and all([u'0' <= char <= u'9' for char in code])
+        for code in codes], dtype=bool)
+    indexes = numpy.flatnonzero(well_formed)
+    birth_dates = [None] * len(codes)
+    genders = [None] * len(codes)
+    if not len(indexes):
+        return valid, birth_dates, genders
+
+    text = u''.join([codes[index] for index in indexes]).encode('ascii')
+    digits = (
+            numpy.frombuffer(text, dtype=numpy.uint8).reshape(-1, 11)
+            .astype(numpy.int64) - ord('0'))
+
+    first = digits[:, :10].dot(FIRST_WEIGHTS) % 11
+    second = digits[:, :10].dot(SECOND_WEIGHTS) % 11
+    expected = numpy.where(
+            first != 10, first, numpy.where(second != 10, second, 0))
+    ok = (expected == digits[:, 10]) & (digits[:, 0] >= 1) & (
+            digits[:, 0] <= 6)
+
+    year = (
+            1800 + 100 * ((digits[:, 0] - 1) // 2) +
+            10 * digits[:, 1] + digits[:, 2])
+    month = 10 * digits[:, 3] + digits[:, 4]
+    day = 10 * digits[:, 5] + digits[:, 6]
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    month_days = numpy.array(
+            [0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+    days = month_days[numpy.clip(month, 0, 12)] + (leap & (month == 2))
+    ok &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= days)
+
+    valid[indexes] = ok
+    for index, code_digits, code_year, code_month, code_day in zip(
+            indexes[ok], digits[ok], year[ok], month[ok], day[ok]):
+        birth_dates[index] = datetime.date(
+                int(code_year), int(code_month), int(code_day))
+        genders[index] = MALE if code_digits[0] % 2 else FEMALE
+    return valid, birth_dates, genders
+
+
+def check_many(codes):
+    """ Checks many identity codes at once.
+
+    Checksums are computed as weighted dot products over the whole
+    column, if NumPy is installed.
+
+    :returns:
+        ``(valid, birth_dates, genders)``, where ``valid`` is a sequence
+        of booleans (NumPy array, if NumPy is installed), and
+        ``birth_dates`` and ``genders`` are lists with None for invalid
+        codes.
+    """
+
+    codes = list(codes)
+    if numpy is not None:
+        return _check_many_numpy(codes)
+    valid = []
+    birth_dates = []
+    genders = []
+    for code in codes:
+        result = decode(code)
+        valid.append(result is not None)
+        birth_dates.append(result and result[0])
+        genders.append(result and result[1])
+    return valid, birth_dates, genders
@@ -0,0 +1,269 @@
+""" Importing of sheets into database (inverse of
+:func:`~django_db_utils.utils.dump_query_to_sheet`).
+"""
+
+
+import codecs
+import csv
+import os
+
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, models, transaction
+
+from django_db_utils.utils import STREAM_DELIMITERS, chunked, collect_fields
+
+
+def get_reader(name):
+    """ Returns function, which reads rows from file ``name``.
+
+    :raises KeyError: if file type is not recognized.
+    """
+
+    extension = os.path.splitext(name)[1][1:].lower()
+    if extension in STREAM_DELIMITERS:
+        return lambda file: read_delimited(
+                file, STREAM_DELIMITERS[extension])
+
+    # pysheets readers are loaded only for files, which need them.
+    from pysheets.sheet import Sheet
+    from pysheets.spreadsheet import SpreadSheet
+    from pysheets.readers import SheetReader, SpreadSheetReader
+
+    try:
+        reader = SpreadSheetReader.plugins.get_by_file(name)
+    except KeyError:
+        reader = SheetReader.plugins.get_by_file(name)
+        return lambda file: read_sheet(Sheet(file, reader=reader()))
+    else:
+        return lambda file: read_sheet(
+                SpreadSheet(file, reader=reader()).join(u'Sheet'))
+
+
+def read_delimited(file, delimiter):
+    """ Generates rows (dictionaries, which map column name to value)
+    from UTF-8 encoded delimited file line by line.
+
+    Byte order mark (added by Excel) is skipped.
+    """
+
+    reader = csv.reader(file, delimiter=delimiter)
+    try:
+        columns = next(reader)
+    except StopIteration:
+        return
+    if columns and columns[0].startswith(codecs.BOM_UTF8):
+        columns[0] = columns[0][len(codecs.BOM_UTF8):]
+    columns = [column.decode('utf-8') for column in columns]
+    for values in reader:
+        yield dict(zip(columns, [value.decode('utf-8') for value in values]))
+
+
+def read_sheet(sheet):
+    """ Generates rows from ``sheet``.
+
+    Sheet readers load whole file, so only delimited files are read
+    with constant memory.
+    """
+
+    for row in sheet:
+        yield dict([(column, row[column]) for column in sheet.columns])
+
+
+def read_rows(file, name=None):
+    """ Generates rows from uploaded ``file``.
+    """
+
+    return get_reader(name or file.name)(file)
+
+
+class ImportResult(object):
+    """ Result of :func:`import_rows`.
+
+    ``errors`` maps index of row (0 for the first data row) to
+    dictionary, which maps column name to list of error messages (column
+    is None for errors of whole row).
+    """
+
+    def __init__(self):
+        self.created = 0
+        self.errors = {}
+
+    def __nonzero__(self):
+        return not self.errors
+
+
+def column_fields(model, exclude=None, auto_fields=False):
+    """ Maps verbose names of ``model`` fields, which can be imported,
+    to fields.
+
+    :param auto_fields:
+        if False, then ``AutoField`` primary keys (exported by
+        :func:`~django_db_utils.utils.dump_query_to_sheet`) are not
+        imported, so database generates them.
+    """
+
+    return dict([
+        (unicode(field.verbose_name), field)
+        for field in collect_fields(model, exclude)
+        if field.rel is None and (
+            auto_fields or not isinstance(field, models.AutoField))])
+
+
+def column_cleaner(field):
+    """ Returns function, which cleans list of ``field`` values at once.
+
+    Fields, which form fields can validate many values at once
+    (``validate_many``), are cleaned with them, so values are normalized
+    the same way as in forms. Other fields are cleaned with model field,
+    but its validators, which have ``validate_many``, check the whole
+    column at once.
+
+    Function returns ``(cleaned, errors)``, where ``cleaned`` is a list
+    of cleaned values (None for invalid ones) and ``errors`` maps index
+    of invalid value to list of error messages.
+    """
+
+    form_field = field.formfield()
+    if hasattr(form_field, 'validate_many'):
+        return form_field.validate_many
+
+    bulk_validators = [
+            validator for validator in field.validators
+            if hasattr(validator, 'validate_many')]
+    validators = [
+            validator for validator in field.validators
+            if not hasattr(validator, 'validate_many')]
+
+    def clean(values):
+        """ Cleans values with model field.
+        """
+        cleaned = []
+        errors = {}
+        for index, value in enumerate(values):
+            try:
+                value = field.to_python(value)
+                field.validate(value, None)
+                for validator in validators:
+                    validator(value)
+            except ValidationError as e:
+                errors[index] = e.messages
+                value = None
+            cleaned.append(value)
+        for validator in bulk_validators:
+            indexes = [
+                    index for index in range(len(values))
+                    if index not in errors and cleaned[index] is not None]
+            column_errors = validator.validate_many(
+                    [cleaned[index] for index in indexes])
+            for position, messages in column_errors.items():
+                errors[indexes[position]] = messages
+                cleaned[indexes[position]] = None
+        return cleaned, errors
+    return clean
+
+
+def build_objects(model, cleaners, rows):
+    """ Creates (unsaved) objects of ``model`` from ``rows``.
+
+    Rows are cleaned column by column. Empty values of fields, which may
+    be blank, are left for defaults.
+
+    :param cleaners:
+        dictionary, which maps column name to ``(field, cleaner)`` (see
+        :func:`column_cleaner`).
+    :returns: list of ``(obj, errors)`` pairs (one of them is None).
+    """
+
+    values = [{} for row in rows]
+    errors = [{} for row in rows]
+    columns = set()
+    for row in rows:
+        columns.update(row)
+    for column in columns:
+        try:
+            field, cleaner = cleaners[column]
+        except KeyError:
+            continue
+        indexes = [
+                index for index, row in enumerate(rows)
+                if column in row and not (
+                    row[column] in (u'', None) and field.blank)]
+        cleaned, column_errors = cleaner(
+                [rows[index][column] for index in indexes])
+        for position, index in enumerate(indexes):
+            if position in column_errors:
+                errors[index][column] = column_errors[position]
+            else:
+                values[index][field.attname] = cleaned[position]
+    return [
+            (None, row_errors) if row_errors else (model(**row_values), None)
+            for row_values, row_errors in zip(values, errors)]
+
+
+def insert_objects(model, objects, using=None):
+    """ Inserts ``objects`` with one bulk insert in transaction.
+    """
+
+    # Models module imports forms, which import this module.
+    from django_db_utils.models import bulk_create
+
+    with transaction.commit_on_success(using=using):
+        bulk_create(model, objects, using=using)
+
+
+def import_rows(model, rows, batch_size=1000, exclude=None, using=None,
+                auto_fields=False):
+    """ Imports ``rows`` (dictionaries, which map verbose names of
+    fields to values) into ``model`` table.
+
+    Rows are processed in chunks of ``batch_size``: every chunk is
+    validated column by column and inserted with one bulk insert in its
+    own transaction. Invalid rows are skipped and their errors are
+    collected. If bulk insert of a chunk fails, its rows are inserted
+    one by one to find failing ones.
+
+    :param auto_fields: see :func:`column_fields`.
+    :returns: :class:`ImportResult`.
+    """
+
+    cleaners = dict([
+        (column, (field, column_cleaner(field)))
+        for column, field in column_fields(
+            model, exclude, auto_fields).items()])
+    result = ImportResult()
+    index = 0
+    for chunk in chunked(rows, batch_size):
+        objects = []
+        indexes = []
+        for obj, errors in build_objects(model, cleaners, chunk):
+            if errors:
+                result.errors[index] = errors
+            else:
+                objects.append(obj)
+                indexes.append(index)
+            index += 1
+        if not objects:
+            continue
+        try:
+            insert_objects(model, objects, using)
+        except DatabaseError:
+            for obj, obj_index in zip(objects, indexes):
+                try:
+                    insert_objects(model, [obj], using)
+                except DatabaseError as e:
+                    result.errors[obj_index] = {None: [unicode(e)]}
+                else:
+                    result.created += 1
+        else:
+            result.created += len(objects)
+    return result
+
+
+def import_file(model, file, name=None, **kwargs):
+    """ Imports uploaded ``file`` into ``model`` table.
+
+    :param kwargs: arguments passed to :func:`import_rows`.
+    :returns: :class:`ImportResult`.
+    """
+
+    return import_rows(model, read_rows(file, name), **kwargs)
@@ -0,0 +1,327 @@
+""" Background export jobs.
+
+Exports are run in a local process pool and written to files in a
+directory; job progress is kept in the same directory, so any web
+server process can report it and serve the result::
+
+    jobs = ExportJobs('/var/lib/exports')
+    job_id = jobs.submit(queryset, 'csv', merge_rules=(...))
+
+    # urls.py
+    url(r'^exports/(?P<job_id>[0-9a-f]{32})/$', download_export,
+        {'directory': '/var/lib/exports'}),
+    url(r'^exports/(?P<job_id>[0-9a-f]{32})/progress/$', export_progress,
+        {'directory': '/var/lib/exports'}),
+
+"""
+
+
+import atexit
+import errno
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from multiprocessing import Pool
+from uuid import uuid4
+
+from django.core.servers.basehttp import FileWrapper
+from django.db import connections
+from django.http import Http404, HttpResponse
+
+from django_db_utils.utils import (
+        ExportStats, STREAM_DELIMITERS, get_writer, stream_query_rows,
+        write_query)
+
+
+logger = logging.getLogger(__name__)
+
+JOB_ID_RE = re.compile(r'^[0-9a-f]{32}\Z')
+
+# Running job touches its heartbeat file every ``HEARTBEAT_INTERVAL``
+# seconds; if it was not touched for ``STALE_AFTER`` seconds, then job
+# process is considered dead.
+HEARTBEAT_INTERVAL = 10
+STALE_AFTER = 60
+
+# Process pools by absolute path of jobs directory.
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(directory, processes):
+    """ Returns process pool of jobs ``directory``, creates it on first
+    use.
+    """
+
+    key = os.path.abspath(directory)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = Pool(processes, initializer=reset_connections)
+        return _pools[key]
+
+
+def close_pools():
+    """ Waits for submitted jobs and stops all process pools.
+    """
+
+    with _pools_lock:
+        pools = _pools.values()
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+        pool.join()
+
+
+atexit.register(close_pools)
+
+
+def reset_connections():
+    """ Forgets database connections inherited from parent process.
+
+    They are not closed, because closing would close them for parent
+    process too.
+    """
+
+    for connection in connections.all():
+        connection.connection = None
+
+
+class JobProgress(ExportStats):
+    """ Export statistics, which store number of exported rows in job
+    state every ``every`` rows.
+    """
+
+    def __init__(self, jobs, job_id, state, every=1000):
+        super(JobProgress, self).__init__()
+        self.jobs = jobs
+        self.job_id = job_id
+        self.state = state
+        self.every = every
+
+    def counted(self, rows):
+        for row in super(JobProgress, self).counted(rows):
+            yield row
+            if self.rows % self.every == 0:
+                self.state['rows'] = self.rows
+                self.jobs.write_state(self.job_id, self.state)
+
+
+def run_export_job(directory, job_id, model, query, using, writer_type,
+                   kwargs):
+    """ Runs export job in pool process.
+    """
+
+    jobs = ExportJobs(directory)
+    state = jobs.state(job_id)
+    temp_path = None
+    stop = threading.Event()
+
+    def beat():
+        """ Touches heartbeat file, until job is finished.
+        """
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            jobs.beat(job_id)
+
+    jobs.beat(job_id)
+    heartbeat = threading.Thread(target=beat)
+    heartbeat.daemon = True
+    heartbeat.start()
+    try:
+        queryset = model._default_manager.db_manager(using).all()
+        queryset.query = query
+        state['status'] = 'running'
+        state['pid'] = os.getpid()
+        jobs.write_state(job_id, state)
+        state['total'] = queryset.count()
+        jobs.write_state(job_id, state)
+
+        progress = JobProgress(jobs, job_id, state)
+        path = jobs.result_path(job_id, state)
+        descriptor, temp_path = tempfile.mkstemp(
+                prefix='.', dir=directory)
+        with os.fdopen(descriptor, 'wb') as result:
+            if writer_type in STREAM_DELIMITERS:
+                for data in stream_query_rows(
+                        queryset, writer_type, stats=progress, **kwargs):
+                    result.write(data)
+            else:
+                write_query(
+                        queryset, writer_type, result, stats=progress,
+                        **kwargs)
+                progress.finish(model)
+        os.rename(temp_path, path)
+        temp_path = None
+
+        state['rows'] = progress.rows
+        state['status'] = 'done'
+    except Exception as e:
+        logger.exception(u'Export job %s failed.', job_id)
+        state['status'] = 'failed'
+        state['error'] = unicode(e)
+        if temp_path is not None:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+    stop.set()
+    heartbeat.join()
+    jobs.write_state(job_id, state)
+
+
+class ExportJobs(object):
+    """ Runs exports in ``processes`` background processes and stores
+    results in ``directory``.
+    """
+
+    def __init__(self, directory, processes=2):
+        self.directory = directory
+        self.processes = processes
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    @property
+    def pool(self):
+        """ Process pool of the directory, which is shared by all
+        instances in this process and is created on first use.
+        """
+        return get_pool(self.directory, self.processes)
+
+    def state_path(self, job_id):
+        """ Returns path of job state file.
+        """
+        return os.path.join(self.directory, '{0}.json'.format(job_id))
+
+    def heartbeat_path(self, job_id):
+        """ Returns path of job heartbeat file.
+        """
+        return os.path.join(self.directory, '{0}.heartbeat'.format(job_id))
+
+    def beat(self, job_id):
+        """ Marks job as alive.
+        """
+        with open(self.heartbeat_path(job_id), 'a'):
+            pass
+        os.utime(self.heartbeat_path(job_id), None)
+
+    def is_stale(self, job_id):
+        """ Checks, if running job did not beat for ``STALE_AFTER``
+        seconds.
+        """
+        try:
+            beaten = os.path.getmtime(self.heartbeat_path(job_id))
+        except OSError:
+            return True
+        return time.time() - beaten > STALE_AFTER
+
+    def result_path(self, job_id, state):
+        """ Returns path of exported file.
+        """
+        return os.path.join(
+                self.directory,
+                '{0}.{1}'.format(job_id, state['extension']))
+
+    def state(self, job_id):
+        """ Returns job state dictionary or None, if there is no such
+        job.
+
+        State has keys ``status`` (``pending``, ``running``, ``done`` or
+        ``failed``), ``rows`` (exported rows), ``total`` (rows to export
+        or None, if not known yet), ``mime_type``, ``extension``,
+        ``error`` and ``pid`` (of process, which runs the job). Running
+        job, which process died, is reported as failed.
+        """
+        if not JOB_ID_RE.match(job_id):
+            return None
+        try:
+            with open(self.state_path(job_id)) as state_file:
+                state = json.load(state_file)
+        except IOError:
+            return None
+        if state['status'] == 'running' and self.is_stale(job_id):
+            state['status'] = 'failed'
+            state['error'] = u'Export process stopped responding.'
+            self.write_state(job_id, state)
+        return state
+
+    def write_state(self, job_id, state):
+        """ Atomically stores job state.
+        """
+        descriptor, temp_path = tempfile.mkstemp(
+                prefix='.', dir=self.directory)
+        with os.fdopen(descriptor, 'w') as state_file:
+            json.dump(state, state_file)
+        os.rename(temp_path, self.state_path(job_id))
+
+    def submit(self, queryset, writer_type, **kwargs):
+        """ Starts exporting ``queryset`` in background.
+
+        :param writer_type: Sheet or spreadsheet writer short name.
+        :param kwargs:
+            arguments passed to
+            :func:`~django_db_utils.utils.dump_query_to_sheet` (they must
+            be picklable).
+        :returns: job id.
+        """
+        writer = get_writer(writer_type)
+        job_id = uuid4().hex
+        self.write_state(job_id, {
+            'status': 'pending',
+            'rows': 0,
+            'total': None,
+            'mime_type': writer.mime_type,
+            'extension': writer.file_extensions[0],
+            'error': None,
+            'pid': None,
+            })
+        self.pool.apply_async(run_export_job, (
+            self.directory, job_id, queryset.model, queryset.query,
+            queryset.db, writer_type, kwargs))
+        return job_id
+
+    def delete(self, job_id):
+        """ Removes job state and exported file.
+        """
+        state = self.state(job_id)
+        if state is None:
+            return
+        for path in (
+                self.result_path(job_id, state), self.state_path(job_id),
+                self.heartbeat_path(job_id)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def export_progress(request, job_id, directory):
+    """ Returns job state as JSON.
+    """
+
+    state = ExportJobs(directory).state(job_id)
+    if state is None:
+        raise Http404
+    return HttpResponse(json.dumps(state), mimetype='application/json')
+
+
+def download_export(request, job_id, directory):
+    """ Serves exported file of finished job.
+    """
+
+    jobs = ExportJobs(directory)
+    state = jobs.state(job_id)
+    if state is None or state['status'] != 'done':
+        raise Http404
+    path = jobs.result_path(job_id, state)
+    response = HttpResponse(
+            FileWrapper(open(path, 'rb')), mimetype=state['mime_type'])
+    response['Content-Length'] = os.path.getsize(path)
+    response['Content-Disposition'] = (
+            'attachment; filename=duomenys.{0}'.format(state['extension']))
+    return response
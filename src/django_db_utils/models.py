@@ -1,15 +1,19 @@
 # -*- coding: utf-8 -*-
 
-from uuid import uuid4 as uuid
+import binascii
+import os
+import time
+from uuid import uuid4 as uuid, UUID
 
 from django.core.exceptions import ValidationError
-from django.core import validators
-from django.db import models
+from django.db import connections, models, router, transaction
 from django.utils.translation import ugettext as _
 
-from django_db_utils.forms import (
+from django_db_utils.validators import (
         NamesValidator, SurnameValidator, EXTENDED_ALPHABET,
-        PhoneNumberValidator, IdentityCodeValidator)
+        IdentityCodeValidator, get_validator, CachedValidator,
+        PostalNumberValidator, phone_number_cache,
+        IdentityCodeModelValidator, ValidatedIdentityCode)
 from django_db_utils import forms
 
 
@@ -23,8 +27,8 @@ class FirstNameField(models.CharField):
         kwargs['verbose_name'] = kwargs.get('verbose_name', _('First name'))
         models.CharField.__init__(self, **kwargs)
         self.validators.append(
-                NamesValidator(
-                    EXTENDED_ALPHABET,
+                get_validator(
+                    NamesValidator, EXTENDED_ALPHABET,
                     validation_exception_type=ValidationError,
                     convert=False,
                     ),
@@ -50,8 +54,8 @@ class LastNameField(models.CharField):
         kwargs['verbose_name'] = kwargs.get('verbose_name', _('Last name'))
         models.CharField.__init__(self, **kwargs)
         self.validators.append(
-                SurnameValidator(
-                    EXTENDED_ALPHABET,
+                get_validator(
+                    SurnameValidator, EXTENDED_ALPHABET,
                     validation_exception_type=ValidationError,
                     convert=False,
                     ),
@@ -78,11 +82,25 @@ class IdentityCodeField(models.CharField):
                 'verbose_name', _(u'Identity code'))
         kwargs['null'] = kwargs.get('null', True)
         models.CharField.__init__(self, **kwargs)
-        self._identity_code_validator = IdentityCodeValidator(
-                validation_exception_type=ValidationError,
-                )
         self.validators.append(
-                lambda text : unicode(self._identity_code_validator(text)))
+                get_validator(
+                    IdentityCodeModelValidator,
+                    get_validator(
+                        IdentityCodeValidator,
+                        validation_exception_type=ValidationError,
+                        ),
+                    ),
+                )
+
+    def get_prep_value(self, value):
+        """ Converts validated identity code back to plain Unicode
+        string for database adapters.
+        """
+        value = super(IdentityCodeField, self).get_prep_value(value)
+        if isinstance(value, ValidatedIdentityCode):
+            return unicode(value)
+        else:
+            return value
 
     def formfield(self, **kwargs):
         """ Creates form field for ModelForm.
@@ -94,27 +112,162 @@ class IdentityCodeField(models.CharField):
         return super(IdentityCodeField, self).formfield(**defaults)
 
 
+def time_ordered_uuid():
+    """ Generates UUID, which starts with current time (UUID version 7
+    layout: 48 bits of Unix time in milliseconds, then random bits).
+
+    Such UUIDs are inserted at the end of an index instead of random
+    places in it.
+    """
+
+    timestamp = int(time.time() * 1000) & 0xFFFFFFFFFFFF
+    random_bits = int(binascii.hexlify(os.urandom(10)), 16)
+    return UUID(int=(
+        timestamp << 80 |
+        0x7 << 76 |
+        (random_bits >> 62 & 0xFFF) << 64 |
+        0x2 << 62 |
+        random_bits & 0x3FFFFFFFFFFFFFFF))
+
+
+def random_uuids(count):
+    """ Generates ``count`` random (version 4) UUIDs from one read of
+    random bytes.
+    """
+
+    data = os.urandom(16 * count)
+    return [
+            UUID(bytes=data[start:start + 16], version=4)
+            for start in range(0, 16 * count, 16)]
+
+
 class UUIDField(models.CharField):
     """ Unique identifier, which is automatically generated.
+
+    :param generator:
+        function, which returns new UUID: ``uuid4`` (default, random)
+        or :func:`time_ordered_uuid`.
     """
 
     description = _("UUID")
-    def __init__(self, **kwargs):
+    def __init__(self, generator=uuid, **kwargs):
         kwargs['max_length'] = 36
         kwargs['unique'] = True
         kwargs['blank'] = True
         models.CharField.__init__(self, **kwargs)
+        self.generator = generator
 
     def pre_save(self, model_instance, add):
         """ If UUID is not already set, then sets one.
         """
         if not getattr(model_instance, self.attname):
-            value = str(uuid())
+            value = str(self.generator())
             setattr(model_instance, self.attname, value)
             return value
         else:
             return super(UUIDField, self).pre_save(model_instance, add)
 
+    def populate(self, objects):
+        """ Sets UUIDs for all ``objects``, which do not have one yet.
+        """
+        objects = [obj for obj in objects if not getattr(obj, self.attname)]
+        if self.generator is uuid:
+            values = random_uuids(len(objects))
+        else:
+            values = [self.generator() for obj in objects]
+        for obj, value in zip(objects, values):
+            setattr(obj, self.attname, str(value))
+
+
+class CompactUUIDField(UUIDField):
+    """ UUID, which is stored in 16 bytes (or in native ``uuid`` column,
+    if database has one).
+
+    In Python it is still a string, the same as in :class:`UUIDField`.
+    """
+
+    __metaclass__ = models.SubfieldBase
+
+    description = _("UUID (compact)")
+
+    db_types = {
+            'postgresql': 'uuid',
+            'mysql': 'binary(16)',
+            'oracle': 'RAW(16)',
+            }
+
+    def db_type(self, connection):
+        """ Returns binary column type for database.
+        """
+        return self.db_types.get(connection.vendor, 'blob')
+
+    def to_python(self, value):
+        """ Converts value from database to UUID string.
+
+        :raises ValidationError: if value is not UUID.
+        """
+        if not value:
+            return value
+        elif isinstance(value, UUID):
+            return str(value)
+        try:
+            if isinstance(value, basestring) and len(value) == 36:
+                return str(UUID(value))
+            elif len(value) == 16:
+                return str(UUID(bytes=str(value)))
+            else:
+                return str(UUID(value))
+        except (TypeError, ValueError):
+            raise ValidationError(
+                    _(u'Enter a valid UUID.'), code='invalid')
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        """ Converts UUID string to value stored in database.
+        """
+        if not value:
+            return None
+        value = UUID(self.to_python(value))
+        if connection.vendor == 'postgresql':
+            return str(value)
+        elif connection.vendor == 'sqlite':
+            return buffer(value.bytes)
+        else:
+            return value.bytes
+
+
+def copy_uuid_column(
+        model, field_name, source_column, batch_size=1000, using=None):
+    """ Copies UUID strings from ``source_column`` to compact column of
+    ``field_name``.
+
+    Helper for data migration from :class:`UUIDField` to
+    :class:`CompactUUIDField`: add the compact column, call this
+    function with the old column name and drop the old column.
+    """
+
+    field = model._meta.get_field(field_name)
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    pk_column = quote_name(model._meta.pk.column)
+
+    cursor = connection.cursor()
+    cursor.execute(
+            'SELECT {0}, {1} FROM {2} WHERE {1} IS NOT NULL'.format(
+                pk_column, quote_name(source_column), table))
+    update_cursor = connection.cursor()
+    update = 'UPDATE {0} SET {1} = %s WHERE {2} = %s'.format(
+            table, quote_name(field.column), pk_column)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        update_cursor.executemany(update, [
+            (field.get_db_prep_value(value, connection), pk)
+            for pk, value in rows])
+    transaction.commit_unless_managed(using=using)
+
 
 class PhoneNumberField(models.CharField):
     """ Model field for phone number.
@@ -127,11 +280,8 @@ class PhoneNumberField(models.CharField):
                 'verbose_name', _('Phone number'))
         models.CharField.__init__(self, **kwargs)
         self.validators.append(
-                PhoneNumberValidator(
-                    u'370',
-                    validation_exception_type=ValidationError,
-                    convert=False,
-                    ),
+                get_validator(
+                    CachedValidator, phone_number_cache, convert=False),
                 )
 
     def formfield(self, **kwargs):
@@ -151,11 +301,27 @@ class PostalNumberField(models.CharField):
 
     description = _("Postal number")
     def __init__(self, **kwargs):
-        length = kwargs.get('length', 5)
+        length = kwargs.pop('length', 5)
         kwargs['max_length'] = kwargs.get('max_length', length)
         kwargs['verbose_name'] = kwargs.get(
                 'verbose_name', _('Postal number'))
         models.CharField.__init__(self, **kwargs)
-        self.validators.append(validators.MaxLengthValidator(length))
-        self.validators.append(validators.MinLengthValidator(length))
-        self.validators.append(validators.RegexValidator(r'^\d*$'))
+        self.validators.append(get_validator(PostalNumberValidator, length))
+
+
+def bulk_create(model, objects, using=None, **kwargs):
+    """ Inserts ``objects`` of ``model`` with ``bulk_create``.
+
+    UUIDs for all :class:`UUIDField` fields are generated before insert
+    for the whole batch at once.
+
+    :param using: database alias or None for default routing.
+    :param kwargs: arguments passed to ``bulk_create``.
+    """
+
+    objects = list(objects)
+    for field in model._meta.fields:
+        if isinstance(field, UUIDField):
+            field.populate(objects)
+    return model._default_manager.db_manager(using).bulk_create(
+            objects, **kwargs)
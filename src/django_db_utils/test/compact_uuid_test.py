@@ -0,0 +1,81 @@
+#!/usr/bin/python
+
+
+import unittest
+from uuid import uuid4
+
+from django_db_utils.benchmark import setup, create_model
+
+setup()
+
+from django.core.exceptions import ValidationError
+from django.db import connection, models
+
+from django_db_utils.models import CompactUUIDField, copy_uuid_column
+
+
+_models = {}
+
+
+def get_models():
+    """ Creates test models and their tables once.
+
+    :returns: ``(Item, MigratedItem)``.
+    """
+
+    if not _models:
+        _models['item'] = create_model('CompactUUIDItem', {
+            'uuid': CompactUUIDField(primary_key=True),
+            'name': models.CharField(max_length=20),
+            })
+        _models['migrated'] = create_model('CompactUUIDMigratedItem', {
+            'uuid': CompactUUIDField(null=True),
+            'old_uuid': models.CharField(max_length=36),
+            })
+    return _models['item'], _models['migrated']
+
+
+class CompactUUIDFieldTest(unittest.TestCase):
+    """ UUIDs are stored in 16 bytes and read back as strings.
+    """
+
+    def setUp(self):
+        self.item, self.migrated = get_models()
+        self.item.objects.all().delete()
+        self.migrated.objects.all().delete()
+
+    def test_round_trip(self):
+        values = [str(uuid4()) for i in range(3)]
+        for i, value in enumerate(values):
+            self.item.objects.create(uuid=value, name=u'Item {0}'.format(i))
+
+        obj = self.item.objects.get(pk=values[1])
+        self.assertEqual(obj.pk, values[1])
+        self.assertTrue(isinstance(obj.pk, str))
+        self.assertEqual(
+                sorted(self.item.objects.filter(
+                    pk__in=values[:2]).values_list('name', flat=True)),
+                [u'Item 0', u'Item 1'])
+
+        cursor = connection.cursor()
+        cursor.execute('SELECT {0} FROM {1}'.format(
+            connection.ops.quote_name('uuid'),
+            connection.ops.quote_name(self.item._meta.db_table)))
+        for (stored,) in cursor.fetchall():
+            self.assertEqual(len(stored), 16)
+
+    def test_invalid_value(self):
+        self.assertRaises(
+                ValidationError, self.item, uuid='not-a-uuid', name=u'')
+
+    def test_copy_uuid_column(self):
+        values = [str(uuid4()) for i in range(5)]
+        for value in values:
+            self.migrated.objects.create(old_uuid=value)
+
+        copy_uuid_column(self.migrated, 'uuid', 'old_uuid', batch_size=2)
+
+        for obj in self.migrated.objects.all():
+            self.assertEqual(obj.uuid, obj.old_uuid)
+        self.assertEqual(
+                self.migrated.objects.filter(uuid__in=values).count(), 5)
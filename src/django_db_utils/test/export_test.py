@@ -0,0 +1,138 @@
+#!/usr/bin/python
+
+
+import unittest
+
+from django_db_utils.benchmark import setup, create_model
+
+setup()
+
+from django.db import models
+
+from django_db_utils.utils import (
+        collect_fields, encode_delimited, join, stream_query_rows)
+
+
+_models = {}
+
+
+def get_models():
+    """ Creates exported models and their tables once.
+
+    :returns: ``(Parent, Detail, Phone)``.
+    """
+
+    if not _models:
+        parent = create_model('ExportParent', {
+            'name': models.CharField(max_length=20),
+            'gender': models.CharField(
+                max_length=1, choices=((u'M', u'Male'), (u'F', u'Female'))),
+            })
+        detail = create_model('ExportDetail', {
+            'parent': models.OneToOneField(parent),
+            'city': models.CharField(max_length=20),
+            })
+        phone = create_model('ExportPhone', {
+            'parent': models.ForeignKey(parent),
+            'number': models.CharField(max_length=20),
+            'kind': models.CharField(max_length=10),
+            })
+        _models.update(parent=parent, detail=detail, phone=phone)
+    return _models['parent'], _models['detail'], _models['phone']
+
+
+def related_name(model):
+    """ Returns name of reverse relation to ``model``.
+    """
+
+    return model._meta.app_label + ':' + model._meta.module_name
+
+
+def reference_rows(queryset, merge_rules, join_rules):
+    """ Builds rows object by object with related managers (as
+    ``dump_query_to_sheet`` did before relationships were fetched in
+    chunks).
+    """
+
+    model = queryset.model
+    fields = collect_fields(model)
+    columns = [field.verbose_name for field in fields]
+    mergable = []
+    joinable = []
+    for related_obj in model._meta.get_all_related_objects():
+        name = related_obj.name.split(':')[1]
+        if related_obj.name in merge_rules:
+            merge_fields = collect_fields(related_obj.model, ('id',))
+            mergable.append((name, related_obj.model, merge_fields))
+            columns.extend([field.verbose_name for field in merge_fields])
+        for field_name, model_name, kwargs in join_rules:
+            if model_name == related_obj.name:
+                field = related_obj.model._meta.get_field(field_name)
+                joinable.append((name, field, kwargs))
+                columns.append(field.verbose_name)
+                break
+
+    def display(obj, field):
+        """ Returns displayable value of ``field``.
+        """
+        display_attr = 'get_{0}_display'.format(field.name)
+        if hasattr(obj, display_attr):
+            return getattr(obj, display_attr)()
+        value = getattr(obj, field.name)
+        return u'' if value is None else value
+
+    rows = [columns]
+    for obj in queryset:
+        row = [display(obj, field) for field in fields]
+        for name, related_model, merge_fields in mergable:
+            try:
+                related = getattr(obj, name)
+            except related_model.DoesNotExist:
+                row.extend([u''] * len(merge_fields))
+            else:
+                row.extend([display(related, field) for field in merge_fields])
+        for name, field, (filter_kwargs, exclude_kwargs) in joinable:
+            query = getattr(obj, '{0}_set'.format(name)).all()
+            row.append(join(
+                query.filter(**filter_kwargs).exclude(**exclude_kwargs),
+                field.name))
+        rows.append(row)
+    return encode_delimited(rows, ',')
+
+
+class ExportTest(unittest.TestCase):
+    """ Chunked export must give the same output as object by object
+    export.
+    """
+
+    def setUp(self):
+        parent, detail, phone = get_models()
+        for model in (phone, detail, parent):
+            model.objects.all().delete()
+        parents = []
+        for i in range(7):
+            parents.append(parent.objects.create(
+                name=u'Parent {0}'.format(i), gender=(u'M', u'F')[i % 2]))
+        for obj in parents[::2]:
+            detail.objects.create(parent=obj, city=u'City {0}'.format(obj.id))
+        # The last parent has no children at all.
+        for obj in parents[:-1]:
+            for kind in (u'home', u'work', u'fax'):
+                phone.objects.create(
+                        parent=obj, kind=kind,
+                        number=u'{0}-{1}'.format(obj.id, kind))
+        self.parent = parent
+        self.merge_rules = (related_name(detail),)
+        self.join_rules = ((
+            'number', related_name(phone),
+            ({'kind__in': (u'home', u'work')}, {'kind': u'work'})),)
+
+    def test_matches_object_by_object_export(self):
+        queryset = self.parent.objects.order_by('id')
+        expected = reference_rows(
+                queryset, self.merge_rules, self.join_rules)
+        for chunk_size in (1, 3, 500):
+            data = ''.join(stream_query_rows(
+                queryset, 'csv', merge_rules=self.merge_rules,
+                join_rules=self.join_rules, chunk_size=chunk_size))
+            self.assertEqual(data, expected, chunk_size)
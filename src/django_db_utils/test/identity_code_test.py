@@ -0,0 +1,59 @@
+#!/usr/bin/python
+
+
+import random
+import unittest
+
+from django.core.exceptions import ValidationError
+
+from django_db_utils.identity_codes import check_many, checksum, decode
+from django_db_utils.validators import IdentityCodeValidator
+
+
+def random_code(rand):
+    """ Generates random identity code, which is valid more often than
+    uniformly random string of digits.
+    """
+
+    digits = [rand.randint(0, 9) for i in range(10)]
+    if rand.random() < 0.8:
+        digits[0] = rand.randint(1, 6)
+        digits[3] = rand.randint(0, 1)
+        digits[5] = rand.randint(0, 2)
+    if rand.random() < 0.8:
+        digits.append(checksum(digits))
+    else:
+        digits.append(rand.randint(0, 9))
+    return u''.join([unicode(digit) for digit in digits])
+
+
+class IdentityCodesTest(unittest.TestCase):
+    """ Bulk checking must agree with scalar validator.
+    """
+
+    def setUp(self):
+        rand = random.Random(2012)
+        self.codes = [random_code(rand) for i in range(5000)] + [
+                u'', u'123', u'3870101123X', u'38702290000']
+        self.validator = IdentityCodeValidator(
+                validation_exception_type=ValidationError)
+
+    def scalar_valid(self, code):
+        """ Checks code with scalar validator.
+        """
+        try:
+            self.validator(code)
+        except ValidationError:
+            return False
+        else:
+            return True
+
+    def test_matches_scalar_validator(self):
+        valid, birth_dates, genders = check_many(self.codes)
+        for code, is_valid, birth_date, gender in zip(
+                self.codes, valid, birth_dates, genders):
+            self.assertEqual(bool(is_valid), self.scalar_valid(code), code)
+            if is_valid:
+                self.assertEqual((birth_date, gender), decode(code))
+            else:
+                self.assertEqual((birth_date, gender), (None, None))
@@ -0,0 +1,45 @@
+#!/usr/bin/python
+
+
+import os
+import subprocess
+import sys
+import unittest
+
+
+IMPORT_SCRIPT = '''
+import sys
+from django.conf import settings
+settings.configure()
+import django_db_utils.utils
+print(','.join(sorted(sys.modules)))
+'''
+
+LAZY_MODULES = ('pysheets',)
+
+
+class ImportTimeTest(unittest.TestCase):
+    """ Importing ``django_db_utils.utils`` must not load sheet machinery.
+    """
+
+    def run_import(self):
+        """ Imports utils in new interpreter, which gets the same module
+        search path as this one (test runner may not use site packages).
+
+        :returns: loaded module names.
+        """
+        process = subprocess.Popen(
+                [sys.executable, '-c', IMPORT_SCRIPT],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+        stdout, stderr = process.communicate()
+        self.assertEqual(process.returncode, 0, stderr)
+        return stdout.strip().split(',')
+
+    def test_sheet_machinery_is_lazy(self):
+        for module in self.run_import():
+            for lazy_module in LAZY_MODULES:
+                self.assertFalse(
+                        module == lazy_module or
+                        module.startswith(lazy_module + '.'),
+                        module)
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import codecs
+import unittest
+from cStringIO import StringIO
+
+from django_db_utils.benchmark import setup, create_model
+
+setup()
+
+from django.db import models
+
+from django_db_utils import forms
+from django_db_utils import models as db_models
+from django_db_utils.importer import import_rows, read_rows
+
+
+_models = {}
+
+
+def get_model():
+    """ Creates imported model and its table once.
+    """
+
+    if 'person' not in _models:
+        _models['person'] = create_model('ImportPerson', {
+            'first_name': db_models.FirstNameField(),
+            'phone_number': db_models.PhoneNumberField(blank=True),
+            'postal_number': db_models.PostalNumberField(blank=True),
+            'code': models.CharField(max_length=10, unique=True),
+            })
+    return _models['person']
+
+
+class ImporterTest(unittest.TestCase):
+    """ Rows are cleaned column by column and inserted in chunks.
+    """
+
+    def setUp(self):
+        self.model = get_model()
+        self.model.objects.all().delete()
+        self.columns = dict([
+            (field.name, unicode(field.verbose_name))
+            for field in self.model._meta.fields])
+
+    def row(self, **values):
+        """ Creates row with column names for field ``values``.
+        """
+        return dict([
+            (self.columns[name], value) for name, value in values.items()])
+
+    def test_values_are_cleaned_like_forms(self):
+        result = import_rows(self.model, [
+            self.row(first_name=u'Jonas', phone_number=u'861234567',
+                     code=u'a'),
+            self.row(first_name=u'Jonasж', code=u'b'),
+            self.row(first_name=u'Petras', postal_number=u'123', code=u'c'),
+            self.row(first_name=u'Petras', postal_number=u'', code=u'd'),
+            ])
+        self.assertEqual(result.created, 2)
+        self.assertEqual(sorted(result.errors), [1, 2])
+        self.assertEqual(
+                result.errors[1].keys(), [self.columns['first_name']])
+        self.assertEqual(
+                result.errors[2].keys(), [self.columns['postal_number']])
+        self.assertEqual(
+                self.model.objects.get(code=u'a').phone_number,
+                forms.PhoneNumberField().clean(u'861234567'))
+        self.assertEqual(
+                self.model.objects.get(code=u'd').postal_number, u'')
+
+    def test_failing_chunk_is_inserted_row_by_row(self):
+        rows = [
+                self.row(first_name=u'Jonas', code=code)
+                for code in (u'a', u'b', u'c', u'c', u'e')]
+        result = import_rows(self.model, rows, batch_size=2)
+        self.assertEqual(result.created, 4)
+        self.assertEqual(result.errors.keys(), [3])
+        self.assertEqual(result.errors[3].keys(), [None])
+        self.assertEqual(
+                sorted(self.model.objects.values_list('code', flat=True)),
+                [u'a', u'b', u'c', u'e'])
+
+    def test_auto_primary_key_is_not_imported(self):
+        row = self.row(first_name=u'Jonas', code=u'a')
+        row[self.columns['id']] = u'999'
+        result = import_rows(self.model, [row])
+        self.assertEqual(result.created, 1)
+        self.assertFalse(self.model.objects.filter(pk=999).exists())
+
+    def test_byte_order_mark_is_skipped(self):
+        data = StringIO(
+                codecs.BOM_UTF8 + u'{0},{1}\r\nJonas,a\r\n'.format(
+                    self.columns['first_name'],
+                    self.columns['code']).encode('utf-8'))
+        rows = list(read_rows(data, name='people.csv'))
+        self.assertEqual(rows, [self.row(first_name=u'Jonas', code=u'a')])
+        self.assertEqual(import_rows(self.model, rows).created, 1)
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from django_db_utils.benchmark import setup, create_model
+
+setup()
+
+from django.db import models
+
+from django_db_utils import utils
+
+
+_models = {}
+
+
+def get_model():
+    """ Creates exported model and its table once.
+    """
+
+    if 'item' not in _models:
+        _models['item'] = create_model('ResumableExportItem', {
+            'name': models.CharField(max_length=20),
+            'number': models.IntegerField(),
+            })
+    return _models['item']
+
+
+class Interrupted(Exception):
+    """ Raised to simulate crash of export process.
+    """
+
+
+class ResumableExportTest(unittest.TestCase):
+    """ Resumed export must produce the same file as uninterrupted one.
+    """
+
+    def setUp(self):
+        self.model = get_model()
+        self.model.objects.all().delete()
+        self.model.objects.bulk_create([
+            self.model(name=u'Item {0}'.format(i), number=i * i)
+            for i in range(25)])
+        self.directory = tempfile.mkdtemp()
+        self.encode_delimited = utils.encode_delimited
+
+    def tearDown(self):
+        utils.encode_delimited = self.encode_delimited
+        shutil.rmtree(self.directory)
+
+    def export(self, name):
+        """ Exports all items to file ``name`` in chunks of 10 rows.
+        """
+        path = os.path.join(self.directory, name)
+        count = utils.export_query_resumable(
+                self.model.objects.all(), 'csv', path, chunk_size=10)
+        return path, count
+
+    def read(self, path):
+        """ Returns file content.
+        """
+        with open(path, 'rb') as exported:
+            return exported.read()
+
+    def test_resumed_export_is_identical(self):
+        expected_path, count = self.export('expected.csv')
+        self.assertEqual(count, 25)
+
+        calls = []
+        def failing_encode_delimited(rows, delimiter):
+            """ Fails while encoding the second chunk.
+            """
+            calls.append(rows)
+            if len(calls) == 3:
+                raise Interrupted()
+            return self.encode_delimited(rows, delimiter)
+        utils.encode_delimited = failing_encode_delimited
+        self.assertRaises(Interrupted, self.export, 'resumed.csv')
+        utils.encode_delimited = self.encode_delimited
+
+        path = os.path.join(self.directory, 'resumed.csv')
+        self.assertTrue(os.path.exists(path + '.checkpoint'))
+        # Part of a chunk, which was being written when process died.
+        with open(path, 'ab') as partial:
+            partial.write('Item 10,100\r\nItem')
+
+        path, count = self.export('resumed.csv')
+        self.assertEqual(count, 15)
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+        self.assertEqual(self.read(path), self.read(expected_path))
@@ -3,13 +3,41 @@
 
 
 import collections
+import contextlib
+import copy
+import csv
+import hashlib
+import json
+import logging
+import os
+import time
+from cStringIO import StringIO
 
-from django.db import models
+from django.db import connections, models
+from django.db.models.fields.subclassing import SubfieldBase
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.dispatch import Signal
 from django.http import HttpResponse
+from django.utils.encoding import force_unicode
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:
+    # Before Django 1.5 HttpResponse streams iterator content itself.
+    StreamingHttpResponse = None
 
-from pysheets.sheet import Sheet
-from pysheets.spreadsheet import SpreadSheet
-from pysheets.writers import SheetWriter, SpreadSheetWriter
+# pysheets (with all its writer plugins) and thread pool are imported in
+# functions, which need them, so importing this module stays cheap.
+
+
+logger = logging.getLogger(__name__)
+
+
+# Writers, which output can be generated row by row: short name to
+# field delimiter.
+STREAM_DELIMITERS = {
+        'csv': ',',
+        'tsv': '\t',
+        }
 
 
 def join(query, field, separator=u'; '):
@@ -19,6 +47,91 @@ def join(query, field, separator=u'; '):
     return separator.join([getattr(obj, field) for obj in query])
 
 
+def chunked(iterable, size):
+    """ Splits ``iterable`` into lists of at most ``size`` items.
+    """
+
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def related_key_attname(related_obj):
+    """ Returns attribute name of parent object, to which reverse
+    relation ``related_obj`` points.
+    """
+
+    return related_obj.field.rel.get_related_field().attname
+
+
+# Maximal number of keys in one ``__in`` lookup (SQLite allows 999
+# query parameters).
+MAX_IN_KEYS = 500
+
+
+def join_related(related_obj, objects, field, filter_kwargs=None,
+                 exclude_kwargs=None, using=None):
+    """ Joins related objects of all ``objects`` with one query per
+    ``MAX_IN_KEYS`` objects.
+
+    :param related_obj: reverse relation description (as returned by
+        ``_meta.get_all_related_objects()``).
+    :param objects: parent objects.
+    :param field: related model field, which values are joined.
+    :param using: database alias of parent objects.
+    :returns: dictionary, which maps parent key to joined string.
+
+    """
+
+    relation_field = related_obj.field
+    key_attname = related_key_attname(related_obj)
+    keys = [getattr(obj, key_attname) for obj in objects]
+    manager = related_obj.model._default_manager.db_manager(using)
+
+    grouped = collections.defaultdict(list)
+    for keys_chunk in chunked(keys, MAX_IN_KEYS):
+        query = manager.filter(
+                **{'{0}__in'.format(relation_field.name): keys_chunk})
+        query = query.filter(**(filter_kwargs or {}))
+        query = query.exclude(**(exclude_kwargs or {}))
+        for related in query:
+            grouped[getattr(related, relation_field.attname)].append(
+                    related)
+    return dict([(key, join(grouped[key], field.name)) for key in keys])
+
+
+def merge_related(related_obj, objects, using=None):
+    """ Fetches one-to-one related objects of all ``objects`` with one
+    query per ``MAX_IN_KEYS`` objects.
+
+    :param related_obj: reverse relation description (as returned by
+        ``_meta.get_all_related_objects()``).
+    :param objects: parent objects.
+    :param using: database alias of parent objects.
+    :returns:
+        dictionary, which maps parent key to related object. Parents
+        without related object are missing from it.
+
+    """
+
+    relation_field = related_obj.field
+    keys = [getattr(obj, related_key_attname(related_obj))
+            for obj in objects]
+    manager = related_obj.model._base_manager.db_manager(using)
+    merged = {}
+    for keys_chunk in chunked(keys, MAX_IN_KEYS):
+        query = manager.filter(
+                **{'{0}__in'.format(relation_field.name): keys_chunk})
+        for related in query:
+            merged[getattr(related, relation_field.attname)] = related
+    return merged
+
+
 def collect_fields(obj, exclude=None):
     """ Collects all non ForeignKey fields.
     """
@@ -33,117 +146,960 @@ def collect_fields(obj, exclude=None):
     return fields
 
 
+def field_getter(model, field):
+    """ Returns function, which gets displayable value of ``field`` from
+    object of ``model``.
+
+    If model has ``get_FOO_display`` method for the field, then it is
+    used, None is changed to empty string.
+    """
+
+    display_attr = 'get_{0}_display'.format(field.name)
+    if hasattr(model, display_attr):
+        return lambda obj: getattr(obj, display_attr)()
+
+    name = field.name
+    def getter(obj):
+        """ Gets field value.
+        """
+        value = getattr(obj, name)
+        if value is None:
+            return u''
+        else:
+            return value
+    return getter
+
+
+def value_converter(field):
+    """ Returns function, which converts database value of ``field`` to
+    the same displayable value, as :func:`field_getter` returns.
+    """
+
+    if field.choices:
+        choices = dict(field.flatchoices)
+        return lambda value: force_unicode(
+                choices.get(value, value), strings_only=True)
+    else:
+        return lambda value: u'' if value is None else value
+
+
+def flat_exportable(model, field):
+    """ Checks, if :func:`value_converter` gives the same value for
+    ``field`` as :func:`field_getter`.
+
+    It does not, if field is relationship, if its values are converted
+    by ``to_python`` on attribute access (``SubfieldBase`` fields) or
+    by ``to_python``, which is not Django's, or if model has hand
+    written ``get_FOO_display`` method.
+    """
+
+    if field.rel is not None or isinstance(type(field), SubfieldBase):
+        return False
+    for cls in type(field).__mro__:
+        if 'to_python' in cls.__dict__:
+            if not cls.__module__.startswith('django.'):
+                return False
+            break
+
+    display = getattr(model, 'get_{0}_display'.format(field.name), None)
+    if display is not None:
+        # Django adds ``get_FOO_display`` (curried
+        # ``Model._get_FIELD_display``) for fields with choices.
+        function = getattr(display, 'im_func', display)
+        if not (field.choices and
+                function.__module__.startswith('django.')):
+            return False
+    return True
+
+
+class CountingCursor(object):
+    """ Database cursor wrapper, which counts executed queries in
+    current phase of ``stats``.
+    """
+
+    def __init__(self, cursor, stats):
+        self.cursor = cursor
+        self.stats = stats
+
+    def execute(self, *args, **kwargs):
+        self.stats.queries[self.stats.phase] += 1
+        return self.cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self.stats.queries[self.stats.phase] += 1
+        return self.cursor.executemany(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+class ExportStats(object):
+    """ Collects timings of export phases, database query counts and
+    row counts.
+
+    Phases are ``probe`` (checking, if queryset is empty), ``query``
+    (fetching exported objects), ``related``
+    (fetching merged and joined objects), ``convert`` (building rows,
+    including foreign key lookups of objects), ``sheet`` (adding rows
+    to sheet) and ``write`` (serializing file). Queries are counted
+    only while database connection is watched (see :meth:`watch`);
+    queries made outside of phases are counted as ``other``.
+    When finished, :data:`export_finished` signal is sent.
+    """
+
+    def __init__(self):
+        self.timings = collections.defaultdict(float)
+        self.queries = collections.defaultdict(int)
+        self.phase = 'other'
+        self.rows = 0
+        self.sheet_rows = 0
+        self.size = 0
+        self.started = time.time()
+        self.duration = None
+
+    def add(self, phase, seconds, queries=0):
+        """ Adds time spent and queries made in ``phase``.
+        """
+        self.timings[phase] += seconds
+        self.queries[phase] += queries
+
+    def merge(self, other):
+        """ Adds numbers collected by ``other`` statistics.
+        """
+        for phase, seconds in other.timings.items():
+            self.timings[phase] += seconds
+        for phase, count in other.queries.items():
+            self.queries[phase] += count
+        self.rows += other.rows
+        self.sheet_rows += other.sheet_rows
+        self.size += other.size
+
+    def watch(self, connection):
+        """ Starts counting queries executed through ``connection``.
+
+        :returns:
+            False, if connection is already watched (then caller must
+            not call :meth:`unwatch`).
+        """
+        if 'cursor' in connection.__dict__:
+            return False
+        cursor = connection.cursor
+        def counting_cursor(*args, **kwargs):
+            """ Returns counting wrapper of connection cursor.
+            """
+            return CountingCursor(cursor(*args, **kwargs), self)
+        connection.cursor = counting_cursor
+        return True
+
+    def unwatch(self, connection):
+        """ Stops counting queries executed through ``connection``.
+        """
+        connection.__dict__.pop('cursor', None)
+
+    def timed(self, iterable, phase):
+        """ Iterates ``iterable`` adding time spent and queries made in
+        it to ``phase``.
+        """
+        iterator = iter(iterable)
+        timings = self.timings
+        while True:
+            previous = self.phase
+            self.phase = phase
+            started = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                timings[phase] += time.time() - started
+                return
+            finally:
+                self.phase = previous
+            timings[phase] += time.time() - started
+            yield item
+
+    def counted(self, rows):
+        """ Iterates ``rows`` counting them and the time spent building
+        them.
+        """
+        for row in self.timed(rows, 'rows'):
+            self.rows += 1
+            yield row
+
+    def finish(self, sender, **kwargs):
+        """ Stops timing and sends :data:`export_finished` signal.
+        """
+        self.duration = time.time() - self.started
+        export_finished.send(sender=sender, stats=self, **kwargs)
+
+    def as_dict(self):
+        """ Returns collected numbers.
+        """
+        timings = dict(self.timings)
+        rows_time = timings.pop('rows', 0.0)
+        timings['convert'] = max(
+                rows_time - timings.get('query', 0.0) -
+                timings.get('related', 0.0), 0.0)
+        queries = dict(self.queries)
+        queries['convert'] = queries.pop('rows', 0)
+        duration = self.duration or (time.time() - self.started)
+        return {
+                'timings': timings,
+                'queries': queries,
+                'rows': self.rows,
+                'rows_per_second': self.rows / duration if duration else 0,
+                'sheet_rows': self.sheet_rows,
+                'size': self.size,
+                'duration': duration,
+                }
+
+    def headers(self):
+        """ Returns HTTP headers with collected numbers.
+        """
+        data = self.as_dict()
+        headers = {
+                'X-Export-Rows': str(data['rows']),
+                'X-Export-Rows-Per-Second': '{0:.1f}'.format(
+                    data['rows_per_second']),
+                'X-Export-Duration': '{0:.3f}'.format(data['duration']),
+                }
+        for phase, seconds in data['timings'].items():
+            headers['X-Export-Time-{0}'.format(phase.title())] = (
+                    '{0:.3f}'.format(seconds))
+        for phase, count in data['queries'].items():
+            headers['X-Export-Queries-{0}'.format(phase.title())] = (
+                    str(count))
+        return headers
+
+
+# Sent with ``stats`` (:class:`ExportStats`) argument, when instrumented
+# export is finished.
+export_finished = Signal(providing_args=['stats'])
+
+
+def log_export_stats(sender, stats, **kwargs):
+    """ Logs export statistics (``export_finished`` receiver).
+    """
+
+    logger.info(u'Export of %s: %r', sender, stats.as_dict())
+
+
+export_finished.connect(log_export_stats)
+
+
+class ExportPlan(object):
+    """ Precompiled description how objects of ``model`` are exported.
+
+    Every column gets a fixed index. Rows are built column by column for
+    a chunk of objects (one list of values per column) and are generated
+    as tuples ordered like ``columns``.
+
+    Plans are cached by :func:`get_export_plan`.
+    """
+
+    def __init__(
+            self, model, fields=None, exclude=None,
+            join_rules=None, merge_rules=None):
+        if fields is None:
+            fields = collect_fields(model, exclude)
+        self.model = model
+        self.fields = fields
+        self.columns = [field.verbose_name for field in fields]
+        self.getters = [
+                (index, field_getter(model, field))
+                for index, field in enumerate(fields)]
+        self.mergable = []
+        self.joinable = []
+        # Models, which objects are displayed in foreign key columns.
+        self.referenced = [
+                field.rel.to for field in fields if field.rel is not None]
+
+        merge_rules = merge_rules or ()
+        join_rules = join_rules or ()
+        for related_obj in model._meta.get_all_related_objects():
+            if related_obj.name in merge_rules:
+                merge_fields = collect_fields(related_obj.model, ('id',))
+                self.referenced.extend([
+                    field.rel.to for field in merge_fields
+                    if field.rel is not None])
+                getters = []
+                for field in merge_fields:
+                    getters.append((
+                        len(self.columns),
+                        field_getter(related_obj.model, field)))
+                    self.columns.append(field.verbose_name)
+                self.mergable.append((
+                    related_obj, related_key_attname(related_obj), getters))
+            for field_name, model_name, kwargs in join_rules:
+                if model_name == related_obj.name:
+                    field = related_obj.model._meta.get_field(field_name)
+                    if field.rel is not None:
+                        self.referenced.append(field.rel.to)
+                    self.joinable.append((
+                        related_obj, related_key_attname(related_obj),
+                        len(self.columns), field, kwargs))
+                    self.columns.append(field.verbose_name)
+                    break
+
+        # Objects, which have no relationships to follow and only
+        # fields with plain database values, do not need to be
+        # instantiated.
+        self.flat = (
+                not self.mergable and not self.joinable and
+                all([flat_exportable(model, field) for field in fields]))
+        if self.flat:
+            self.attnames = [field.attname for field in fields]
+            self.converters = [value_converter(field) for field in fields]
+
+    def with_join_rules(self, join_rules):
+        """ Returns copy of plan, which filters joined objects with
+        arguments of ``join_rules`` (rules must join the same fields as
+        rules of this plan).
+        """
+
+        rule_kwargs = {}
+        for field_name, model_name, kwargs in join_rules or ():
+            rule_kwargs.setdefault(model_name, kwargs)
+        plan = copy.copy(self)
+        plan.joinable = [
+                (related_obj, key_attname, index, field,
+                 rule_kwargs[related_obj.name])
+                for related_obj, key_attname, index, field, kwargs in (
+                    self.joinable)]
+        return plan
+
+    def models(self):
+        """ Returns list of models, which data is exported (including
+        models referenced by foreign keys).
+        """
+
+        exported = [self.model] + [
+                related_obj.model
+                for related_obj, key_attname, getters in self.mergable] + [
+                related_obj.model
+                for related_obj, key_attname, index, field, kwargs in (
+                    self.joinable)] + self.referenced
+        models = []
+        for model in exported:
+            if model not in models:
+                models.append(model)
+        return models
+
+    def query_rows(self, queryset, chunk_size=500, stats=None,
+                   key_field=None):
+        """ Generates rows (tuples ordered like ``columns``) for
+        ``queryset`` without filling its result cache.
+
+        :param stats: :class:`ExportStats` or None.
+        :param key_field:
+            if not None, then ``(key, row)`` pairs are generated, where
+            ``key`` is database value of this field of the object.
+        """
+
+        if self.flat:
+            if key_field is None:
+                values = queryset.values_list(*self.attnames)
+            else:
+                values = queryset.values_list(key_field.name, *self.attnames)
+            values = values.iterator()
+            if stats is not None:
+                values = stats.timed(values, 'query')
+            rows = self.iter_flat_rows(
+                    values, chunk_size, key_field is not None)
+        else:
+            objects = queryset.iterator()
+            if stats is not None:
+                objects = stats.timed(objects, 'query')
+            rows = self.iter_rows(
+                    objects, chunk_size, stats,
+                    key_field and key_field.attname, queryset.db)
+        if stats is not None:
+            rows = stats.counted(rows)
+        return rows
+
+    def iter_flat_rows(self, values, chunk_size=500, keyed=False):
+        """ Generates rows from tuples of field values.
+
+        :param keyed:
+            if True, then tuples start with key and ``(key, row)``
+            pairs are generated.
+        """
+
+        converters = self.converters
+        for chunk in chunked(values, chunk_size):
+            columns = zip(*chunk)
+            if keyed:
+                keys = columns.pop(0)
+            block = [
+                    map(converter, column)
+                    for converter, column in zip(converters, columns)]
+            rows = zip(*block)
+            if keyed:
+                rows = zip(keys, rows)
+            for row in rows:
+                yield row
+
+    def iter_rows(self, objects, chunk_size=500, stats=None,
+                  row_key_attname=None, using=None):
+        """ Generates rows for ``objects``.
+
+        Related objects for merged and joined relationships are fetched
+        with one query per relationship per ``chunk_size`` objects (but
+        not more than ``MAX_IN_KEYS``).
+
+        :param row_key_attname:
+            if not None, then ``(key, row)`` pairs are generated, where
+            ``key`` is this attribute of the object.
+        :param using:
+            database alias, from which related objects are fetched.
+        """
+
+        for objects in chunked(objects, chunk_size):
+            if stats is not None:
+                previous = stats.phase
+                stats.phase = 'related'
+                started = time.time()
+            merged = []
+            for related_obj, key_attname, getters in self.mergable:
+                merged.append((
+                    key_attname, getters,
+                    merge_related(related_obj, objects, using)))
+            joined = []
+            for related_obj, key_attname, index, field, (
+                    filter_kwargs, exclude_kwargs) in self.joinable:
+                joined.append((
+                    index, key_attname,
+                    join_related(
+                        related_obj, objects, field,
+                        filter_kwargs, exclude_kwargs, using)))
+            if stats is not None:
+                stats.add('related', time.time() - started)
+                stats.phase = previous
+
+            block = [None] * len(self.columns)
+            for index, getter in self.getters:
+                block[index] = [getter(obj) for obj in objects]
+            for key_attname, getters, related_objects in merged:
+                related = [
+                        related_objects.get(getattr(obj, key_attname))
+                        for obj in objects]
+                for index, getter in getters:
+                    block[index] = [
+                            u'' if related_obj is None
+                            else getter(related_obj)
+                            for related_obj in related]
+            for index, key_attname, values in joined:
+                block[index] = [
+                        values[getattr(obj, key_attname)]
+                        for obj in objects]
+            rows = zip(*block)
+            if row_key_attname is not None:
+                rows = zip([
+                    getattr(obj, row_key_attname) for obj in objects], rows)
+            for row in rows:
+                yield row
+
+
+_export_plans = {}
+
+
+def _freeze(value):
+    """ Converts ``value`` to hashable form for using as cache key.
+    """
+
+    if isinstance(value, dict):
+        return tuple(sorted(
+            [(key, _freeze(item)) for key, item in value.items()]))
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        return tuple([_freeze(item) for item in value])
+    else:
+        return value
+
+
+def get_export_plan(
+        model, fields=None, exclude=None, join_rules=None, merge_rules=None):
+    """ Returns cached :class:`ExportPlan`, creates it if needed.
+
+    Filter and exclude arguments of ``join_rules`` are not part of the
+    cache key (they may contain querysets, dates, etc.); they are set
+    on a copy of the cached plan.
+    """
+
+    rule_names = join_rules and [
+            (field_name, model_name)
+            for field_name, model_name, kwargs in join_rules]
+    key = _freeze((model, fields, exclude, rule_names, merge_rules))
+    try:
+        plan = _export_plans[key]
+    except KeyError:
+        plan = ExportPlan(model, fields, exclude, join_rules, merge_rules)
+        _export_plans[key] = plan
+        return plan
+    except TypeError:
+        # Some rule argument is not hashable, so plan is not cached.
+        return ExportPlan(model, fields, exclude, join_rules, merge_rules)
+    return plan.with_join_rules(join_rules)
+
+
+def clear_export_plans(sender=None, **kwargs):
+    """ Forgets all cached export plans.
+    """
+
+    _export_plans.clear()
+
+
+models.signals.class_prepared.connect(clear_export_plans)
+
+
+def probe_queryset(queryset, stats=None):
+    """ Checks, if ``queryset`` has any objects. Empty querysets are
+    exported as empty files (without header).
+
+    :param stats: :class:`ExportStats` or None.
+    """
+
+    if stats is None:
+        return queryset.exists()
+    previous = stats.phase
+    stats.phase = 'probe'
+    started = time.time()
+    try:
+        return queryset.exists()
+    finally:
+        stats.add('probe', time.time() - started)
+        stats.phase = previous
+
+
+@contextlib.contextmanager
+def counting_queries(stats, using):
+    """ Counts queries made through ``using`` database connection
+    inside the block in ``stats`` (if it is not None).
+    """
+
+    connection = connections[using]
+    if stats is None or not stats.watch(connection):
+        yield
+        return
+    try:
+        yield
+    finally:
+        stats.unwatch(connection)
+
+
 def dump_query_to_sheet(
         queryset, sheet=None, fields=None, exclude=None,
         join_rules=None,
-        merge_rules=None):
+        merge_rules=None,
+        chunk_size=500,
+        stats=None):
     """ Dumps query to sheet.
 
-    If ``sheet`` is None, then creates one.
+    If ``sheet`` is None, then creates one. Queryset is walked once with
+    ``iterator()``, so its result cache is not filled.
 
     :param fields: what fields from object to include, if None then all.
     :param exclude:
         what fields from object to exclude, if None then none.
     :param join_rules: what relationships to join_rules by field.
     :param merge_rules:
-        what relationships to merge_rules into sheet. (``get`` method
-        must return an item or raise DoesNotExist error).
+        what relationships to merge_rules into sheet. (Must be
+        reverse one-to-one relationships.)
+    :param chunk_size:
+        how many objects are processed at once. Related objects for
+        ``join_rules`` and ``merge_rules`` are fetched with one query
+        per rule per chunk.
+    :param stats:
+        :class:`ExportStats`, which collects statistics, or None.
     :returns: sheet object.
 
     """
 
     if sheet is None:
+        from pysheets.sheet import Sheet
         sheet = Sheet()
 
-    if len(queryset) < 1:
-        return sheet
-    obj = queryset[0]
-
-    if fields is None:
-        fields = collect_fields(obj, exclude)
-
-    def modifier(sheet, row):
-        """ Changes fields to Unicode strings.
-        """
-        new_row = collections.defaultdict(unicode)
-        for field_name, (obj, field) in row.items():
-            if obj is not None:
-                display_attr = 'get_{0}_display'.format(field.name)
-                if hasattr(obj, display_attr):
-                    new_row[field_name] = getattr(obj, display_attr)()
-                else:
-                    value = getattr(obj, field.name)
-                    if value is None:
-                        new_row[field_name] = u''
-                    else:
-                        new_row[field_name] = value
-            else:
-                new_row[field_name] = field
-        return new_row
-
-    sheet.add_insert_validator(modifier)
-    sheet.add_columns([field.verbose_name for field in fields])
-
-    mergable = {}
-    joinable = {}
-    merge_rules = merge_rules or ()
-    join_rules = join_rules or ()
-    for related_obj in obj._meta.get_all_related_objects():
-        if related_obj.name in merge_rules:
-            model = related_obj.model
-            merge_fields = collect_fields(model, ('id',))
-            mergable[related_obj.name] = merge_fields, model
-            sheet.add_columns([
-                field.verbose_name
-                for field in merge_fields
-                ])
-        for field_name, model_name, kwargs in join_rules:
-            if model_name == related_obj.name:
-                model = related_obj.model
-                field = model._meta.get_field(field_name)
-                joinable[related_obj.name.split(':')[1]] = field, kwargs
-                sheet.add_column(field.verbose_name)
-                break
+    with counting_queries(stats, queryset.db):
+        if not probe_queryset(queryset, stats):
+            return sheet
 
-    for obj in queryset:
-        row = dict([(field.verbose_name, (obj, field)) for field in fields])
-        for full_name, (merge_fields, model) in mergable.items():
-            name = full_name.split(':')[1]
-            try:
-                related_obj = getattr(obj, name)
-                for field in merge_fields:
-                    row[field.verbose_name] = related_obj, field
-            except model.DoesNotExist:
-                pass
-        for name, (field, (filter_kwargs, exclude_kwargs)) in (
-                joinable.items()):
-            query = getattr(obj, '{0}_set'.format(name)).all()
-            row[field.verbose_name] = None, join(
-                    query.filter(**filter_kwargs).exclude(**exclude_kwargs),
-                    field.name)
-        sheet.append_dict(row)
+        plan = get_export_plan(
+                queryset.model, fields, exclude, join_rules, merge_rules)
+        sheet.add_columns(plan.columns)
+        columns = plan.columns
+        rows = plan.query_rows(queryset, chunk_size, stats)
+        if stats is None:
+            for row in rows:
+                # pysheets rows are dictionaries; this is the only
+                # dictionary built per row.
+                sheet.append_dict(
+                        collections.defaultdict(unicode, zip(columns, row)))
+        else:
+            previous = stats.phase
+            stats.phase = 'sheet'
+            started = time.time()
+            rows_time = stats.timings['rows']
+            count = stats.rows
+            for row in rows:
+                sheet.append_dict(
+                        collections.defaultdict(unicode, zip(columns, row)))
+            stats.add(
+                    'sheet', time.time() - started -
+                    (stats.timings['rows'] - rows_time))
+            stats.sheet_rows += stats.rows - count
+            stats.phase = previous
 
     return sheet
 
 
-def download_query(queryset, writer_type, **kwargs):
-    """ Generates sheet from queryset for downloading.
+def encode_delimited(rows, delimiter):
+    """ Encodes ``rows`` (sequences of values) to UTF-8 delimited text.
+    """
 
-    :param writer_type: Sheet writer short name.
+    buf = StringIO()
+    csv_writer = csv.writer(buf, delimiter=delimiter)
+    for row in rows:
+        csv_writer.writerow([unicode(value).encode('utf-8') for value in row])
+    return buf.getvalue()
+
+
+def stream_query_rows(
+        queryset, writer_type, fields=None, exclude=None,
+        join_rules=None, merge_rules=None, chunk_size=500, stats=None):
+    """ Generates encoded sheet from queryset chunk by chunk.
+
+    Queryset is walked with ``iterator()``, so objects are not cached
+    and at most ``chunk_size`` of them are kept in memory. Like
+    :func:`dump_query_to_sheet`, empty queryset generates nothing.
+
+    :param writer_type: short name of streamable sheet writer (one of
+        ``STREAM_DELIMITERS`` keys).
+    :param stats:
+        :class:`ExportStats`, which is finished, when all data is
+        generated, or None.
+    """
+
+    delimiter = STREAM_DELIMITERS[writer_type]
+    with counting_queries(stats, queryset.db):
+        if probe_queryset(queryset, stats):
+            plan = get_export_plan(
+                    queryset.model, fields, exclude, join_rules, merge_rules)
+            data = encode_delimited([plan.columns], delimiter)
+            if stats is not None:
+                stats.size += len(data)
+            yield data
+            for rows in chunked(
+                    plan.query_rows(queryset, chunk_size, stats),
+                    chunk_size):
+                data = encode_delimited(rows, delimiter)
+                if stats is not None:
+                    stats.size += len(data)
+                yield data
+    if stats is not None:
+        stats.finish(queryset.model)
+
+
+def export_query_resumable(
+        queryset, writer_type, path, checkpoint_path=None, chunk_size=1000,
+        fields=None, exclude=None, join_rules=None, merge_rules=None):
+    """ Writes queryset to file ``path`` walking it by primary key
+    ranges (keyset pagination).
+
+    After every chunk the file is flushed to disk and the last exported
+    primary key with file size is stored in ``checkpoint_path`` (by
+    default ``path`` with ``.checkpoint`` suffix). If checkpoint exists,
+    export resumes after it and the file is the same as after an
+    uninterrupted run. Checkpoint is removed, when export is finished.
+
+    Rows are exported in primary key order.
+
+    :param writer_type: short name of streamable sheet writer (one of
+        ``STREAM_DELIMITERS`` keys).
+    :param chunk_size: how many rows are fetched with one query.
+    :returns: number of rows written by this call.
+    """
+
+    delimiter = STREAM_DELIMITERS[writer_type]
+    plan = get_export_plan(
+            queryset.model, fields, exclude, join_rules, merge_rules)
+    columns = plan.columns
+    if checkpoint_path is None:
+        checkpoint_path = path + '.checkpoint'
+
+    def save_checkpoint(output, last_pk):
+        """ Flushes output and stores checkpoint atomically.
+        """
+        output.flush()
+        os.fsync(output.fileno())
+        temp_path = checkpoint_path + '.tmp'
+        with open(temp_path, 'w') as checkpoint_file:
+            json.dump(
+                    {'last_pk': last_pk, 'offset': output.tell()},
+                    checkpoint_file)
+        os.rename(temp_path, checkpoint_path)
+
+    try:
+        with open(checkpoint_path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+    except IOError:
+        output = open(path, 'wb')
+        output.write(encode_delimited([columns], delimiter))
+        last_pk = None
+        save_checkpoint(output, last_pk)
+    else:
+        output = open(path, 'r+b')
+        output.truncate(checkpoint['offset'])
+        output.seek(checkpoint['offset'])
+        last_pk = checkpoint['last_pk']
+
+    pk_field = queryset.model._meta.pk
+    queryset = queryset.order_by(pk_field.name)
+    count = 0
+    with output:
+        while True:
+            chunk = queryset
+            if last_pk is not None:
+                chunk = chunk.filter(pk__gt=last_pk)
+            rows = list(plan.query_rows(
+                chunk[:chunk_size], chunk_size, key_field=pk_field))
+            if not rows:
+                break
+            output.write(encode_delimited(
+                [row for key, row in rows], delimiter))
+            count += len(rows)
+            last_pk = rows[-1][0]
+            save_checkpoint(output, last_pk)
+    os.remove(checkpoint_path)
+    return count
+
+
+def dump_queries_to_spreadsheet(
+        querysets, spreadsheet=None, workers=4, **kwargs):
+    """ Dumps each queryset to its own sheet of spreadsheet.
+
+    If ``spreadsheet`` is None, then creates one. Sheets are filled
+    concurrently in a thread pool; every thread uses its own database
+    connection, which is closed when the sheet is done.
+
+    :param querysets:
+        mapping (or sequence of pairs) of sheet name to queryset. Sheets
+        are added in this order.
+    :param workers: how many sheets are filled at once.
+    :param kwargs:
+        arguments passed to :func:`dump_query_to_sheet`. If ``stats``
+        is given, then every sheet is measured with its own
+        :class:`ExportStats`, which are merged into it (so timings are
+        sums over all threads).
+    :returns: spreadsheet object.
+
+    """
+
+    from multiprocessing.pool import ThreadPool
+
+    if spreadsheet is None:
+        from pysheets.spreadsheet import SpreadSheet
+        spreadsheet = SpreadSheet()
+    if hasattr(querysets, 'items'):
+        querysets = querysets.items()
+    querysets = list(querysets)
+    if not querysets:
+        return spreadsheet
+
+    stats = kwargs.pop('stats', None)
+
+    def dump(queryset):
+        """ Dumps queryset to new sheet in worker thread.
+
+        :returns: ``(sheet, stats)``.
+        """
+        sheet_stats = None if stats is None else ExportStats()
+        try:
+            return (
+                    dump_query_to_sheet(
+                        queryset, stats=sheet_stats, **kwargs),
+                    sheet_stats)
+        finally:
+            connections[queryset.db].close()
+
+    pool = ThreadPool(min(workers, len(querysets)))
+    try:
+        results = pool.map(dump, [queryset for name, queryset in querysets])
+    finally:
+        pool.close()
+        pool.join()
+
+    sheets = []
+    for sheet, sheet_stats in results:
+        sheets.append(sheet)
+        if stats is not None:
+            stats.merge(sheet_stats)
+
+    for (name, queryset), sheet in zip(querysets, sheets):
+        spreadsheet.load(sheet, name=name)
+    return spreadsheet
+
+
+def download_queries(querysets, writer_type, workers=4, **kwargs):
+    """ Generates spreadsheet with sheet per queryset for downloading.
+
+    :param querysets: mapping of sheet name to queryset.
+    :param writer_type: Spreadsheet writer short name.
+    :param workers: how many sheets are filled at once.
+    """
+
+    from pysheets.writers import SpreadSheetWriter
+
+    writer = SpreadSheetWriter.plugins[writer_type]
+    data = dump_queries_to_spreadsheet(querysets, workers=workers, **kwargs)
+
+    response = HttpResponse(mimetype=writer.mime_type)
+    response['Content-Disposition'] = (
+            'attachment; filename=duomenys.{0}'.format(
+                writer.file_extensions[0]))
+    data.write(response, writer=writer())
+    return response
+
+
+def get_writer(writer_type):
+    """ Returns sheet or spreadsheet writer class by its short name.
+
+    :raises KeyError: if there is no such writer.
     """
 
+    from pysheets.writers import SheetWriter, SpreadSheetWriter
+
+    try:
+        return SheetWriter.plugins[writer_type]
+    except KeyError:
+        return SpreadSheetWriter.plugins[writer_type]
+
+
+def write_query(queryset, writer_type, file, stats=None, **kwargs):
+    """ Dumps queryset to sheet and writes it to ``file``.
+
+    :param writer_type: Sheet or spreadsheet writer short name.
+    :param stats: :class:`ExportStats` or None.
+    :param kwargs: arguments passed to :func:`dump_query_to_sheet`.
+    """
+
+    from pysheets.spreadsheet import SpreadSheet
+    from pysheets.writers import SheetWriter, SpreadSheetWriter
+
     try:
         writer = SheetWriter.plugins[writer_type]
-        data = dump_query_to_sheet(queryset, **kwargs)
     except KeyError:
         writer = SpreadSheetWriter.plugins[writer_type]
         data = SpreadSheet()
         sheet = data.create_sheet(u'Duomenys')
-        dump_query_to_sheet(queryset, sheet, **kwargs)
+        dump_query_to_sheet(queryset, sheet, stats=stats, **kwargs)
+    else:
+        data = dump_query_to_sheet(queryset, stats=stats, **kwargs)
 
-    response = HttpResponse(mimetype=writer.mime_type)
+    if stats is None:
+        data.write(file, writer=writer())
+    else:
+        with counting_queries(stats, queryset.db):
+            previous = stats.phase
+            stats.phase = 'write'
+            started = time.time()
+            data.write(file, writer=writer())
+            stats.add('write', time.time() - started)
+            stats.phase = previous
+
+
+def export_cache_key(cache, queryset, writer_type, kwargs):
+    """ Returns key of cached export of ``queryset``.
+
+    Key depends on compiled SQL and its parameters, writer, export
+    arguments and versions of all exported models in ``cache``.
+    Exported models are watched by ``cache`` for changes. Key does not
+    depend on process, so processes can share cache.
+    """
+
+    plan_kwargs = dict([
+        (name, value) for name, value in kwargs.items()
+        if name in ('fields', 'exclude', 'join_rules', 'merge_rules')])
+    models = get_export_plan(queryset.model, **plan_kwargs).models()
+    cache.watch(*models)
+    try:
+        sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    except EmptyResultSet:
+        # Query, which is known to be empty (for example, filtered by
+        # empty ``__in`` list).
+        sql, params = None, ()
+    kwargs = dict(kwargs)
+    if kwargs.get('fields') is not None:
+        # Field objects are represented by memory addresses.
+        kwargs['fields'] = [field.name for field in kwargs['fields']]
+    key = repr((
+        queryset.db, sql, tuple(params), writer_type, _freeze(kwargs),
+        [cache.model_version(model) for model in models]))
+    return hashlib.sha1(key).hexdigest()
+
+
+def download_query(queryset, writer_type, stream=False, cache=None,
+                   stats=None, stats_headers=False, **kwargs):
+    """ Generates sheet from queryset for downloading.
+
+    :param writer_type: Sheet writer short name.
+    :param stream:
+        if True, then response content is generated while it is sent
+        to the client (only for writers in ``STREAM_DELIMITERS``).
+    :raises KeyError:
+        if there is no such writer or it cannot stream, before any
+        content is generated.
+    :param cache:
+        cache of exported files (for example,
+        :class:`~django_db_utils.export_cache.FileExportCache`). Not used
+        when streaming.
+    :param stats:
+        :class:`ExportStats`, which collects statistics, or None. It is
+        finished (and :data:`export_finished` is sent), when response
+        content is ready.
+    :param stats_headers:
+        if True, then statistics are added to response headers (not
+        possible when streaming).
+    """
+
+    if stream:
+        if writer_type not in STREAM_DELIMITERS:
+            raise KeyError(writer_type)
+        from pysheets.writers import SheetWriter
+        writer = SheetWriter.plugins[writer_type]
+        content = stream_query_rows(
+                queryset, writer_type, stats=stats, **kwargs)
+        if StreamingHttpResponse is None:
+            response = HttpResponse(content, mimetype=writer.mime_type)
+        else:
+            response = StreamingHttpResponse(
+                    content, content_type=writer.mime_type)
+        response['Content-Disposition'] = (
+                'attachment; filename=duomenys.{0}'.format(
+                    writer.file_extensions[0]))
+        return response
+
+    writer = get_writer(writer_type)
+
+    content = None
+    if cache is not None:
+        key = export_cache_key(cache, queryset, writer_type, kwargs)
+        content = cache.get(key)
+
+    if content is None:
+        buf = StringIO()
+        write_query(queryset, writer_type, buf, stats=stats, **kwargs)
+        content = buf.getvalue()
+        if cache is not None:
+            cache.set(key, content)
+
+    response = HttpResponse(content, mimetype=writer.mime_type)
     response['Content-Disposition'] = (
             'attachment; filename=duomenys.{0}'.format(
                 writer.file_extensions[0]))
-    data.write(response, writer=writer())
+    if stats is not None:
+        stats.size = len(content)
+        stats.finish(queryset.model)
+        if stats_headers:
+            for header, value in stats.headers().items():
+                response[header] = value
     return response
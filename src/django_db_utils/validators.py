@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+""" Shared validator instances.
+"""
+
+import collections
+import re
+import threading
+
+from django.core.exceptions import ValidationError
+from django.utils.translation import ugettext_lazy as _
+
+from db_utils.validators.name import (
+        NamesValidator, SurnameValidator, ALPHABET_LT)
+from db_utils.validators.phone_number import PhoneNumberValidator
+from db_utils.validators.identity_code import IdentityCodeValidator
+
+
+class Alphabet(tuple):
+    """ Tuple of letters with constant time membership test.
+    """
+
+    def __new__(cls, letters):
+        alphabet = super(Alphabet, cls).__new__(cls, letters)
+        alphabet.letters = frozenset(alphabet)
+        return alphabet
+
+    def __contains__(self, letter):
+        try:
+            return letter in self.letters
+        except TypeError:
+            return super(Alphabet, self).__contains__(letter)
+
+
+EXTENDED_ALPHABET = Alphabet(
+        ALPHABET_LT + (u'x', u'w', u'q', u'ä', u'ü', u'ö', u'ß'))
+# Lower and upper case letters of ``EXTENDED_ALPHABET``.
+EXTENDED_LETTERS = frozenset(
+        EXTENDED_ALPHABET + tuple([
+            letter.upper() for letter in EXTENDED_ALPHABET]))
+
+
+def foreign_letters(value, letters=EXTENDED_LETTERS):
+    """ Returns set of letters of ``value``, which are not in
+    ``letters``.
+    """
+
+    return set([
+        letter for letter in set(value).difference(letters)
+        if letter.isalpha()])
+
+
+_validators = {}
+
+
+def get_validator(validator_class, *args, **kwargs):
+    """ Returns instance of ``validator_class`` constructed with given
+    arguments.
+
+    Instance is created only once per process for each set of arguments
+    and is shared by all callers, so it must not be modified.
+    """
+
+    key = (validator_class, args, tuple(sorted(kwargs.items())))
+    try:
+        return _validators[key]
+    except KeyError:
+        validator = validator_class(*args, **kwargs)
+        _validators[key] = validator
+        return validator
+
+
+class NormalizationCache(object):
+    """ Bounded LRU cache of ``validator`` results keyed by raw value.
+
+    Errors are cached too. Normalized value is also cached as the result
+    of itself, so already normalized values are not validated again.
+
+    :param size: maximal number of cached values; may be changed later.
+    """
+
+    def __init__(self, validator, size=1024):
+        self.validator = validator
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._results = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._results)
+
+    def clear(self):
+        """ Empties cache and resets counters.
+        """
+        with self._lock:
+            self._results.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def _store(self, value, result):
+        """ Adds ``result`` as the most recently used one.
+        """
+        self._results.pop(value, None)
+        self._results[value] = result
+        while len(self._results) > self.size:
+            self._results.popitem(last=False)
+
+    def normalize(self, value):
+        """ Returns normalized value or raises validation error.
+        """
+        with self._lock:
+            try:
+                result = self._results.pop(value)
+            except KeyError:
+                result = None
+            else:
+                self.hits += 1
+                self._results[value] = result
+        if result is None:
+            try:
+                result = self.validator(value), None
+            except ValidationError as e:
+                result = None, e
+            with self._lock:
+                self.misses += 1
+                self._store(value, result)
+                if result[1] is None:
+                    self._store(result[0], result)
+        if result[1] is not None:
+            raise result[1]
+        return result[0]
+
+
+class CachedValidator(object):
+    """ Validator, which normalizes values through ``cache``.
+
+    :param convert:
+        if False, then value is only checked and returned unchanged.
+    """
+
+    def __init__(self, cache, convert=True):
+        self.cache = cache
+        self.convert = convert
+
+    def __call__(self, value):
+        normalized = self.cache.normalize(value)
+        if self.convert:
+            return normalized
+        else:
+            return value
+
+
+class PostalNumberValidator(object):
+    """ Checks, that value consists of exactly ``length`` digits.
+    """
+
+    def __init__(self, length):
+        self.length = length
+        self.regex = re.compile(r'\d{{{0}}}\Z'.format(length))
+
+    def error_message(self):
+        """ Returns error message.
+        """
+        return _(u'Postal number must consist of {0} digits.').format(
+                self.length)
+
+    def __call__(self, value):
+        if not self.regex.match(value):
+            raise ValidationError(self.error_message(), code='invalid')
+
+    def validate_many(self, values):
+        """ Validates many values at once.
+
+        :returns:
+            dictionary, which maps index of invalid value to list of
+            error messages.
+        """
+        match = self.regex.match
+        invalid = [
+                index for index, value in enumerate(values)
+                if not match(value)]
+        if not invalid:
+            return {}
+        message = self.error_message()
+        return dict([(index, [message]) for index in invalid])
+
+
+class ValidatedIdentityCode(unicode):
+    """ Identity code, which was already validated (for example, by
+    form field).
+    """
+
+
+class IdentityCodeModelValidator(object):
+    """ Validates identity code, unless it is
+    :class:`ValidatedIdentityCode`.
+    """
+
+    def __init__(self, validator):
+        self.validator = validator
+
+    def __call__(self, value):
+        if isinstance(value, ValidatedIdentityCode):
+            return value
+        else:
+            return unicode(self.validator(value))
+
+
+# Shared by form and model phone number fields.
+phone_number_cache = NormalizationCache(
+        get_validator(
+            PhoneNumberValidator, u'370',
+            validation_exception_type=ValidationError))
+
+
+def warm_validators():
+    """ Creates validators used by form and model fields of this package.
+    """
+
+    for kwargs in ({}, {'convert': False}):
+        get_validator(
+                NamesValidator, EXTENDED_ALPHABET,
+                validation_exception_type=ValidationError, **kwargs)
+        get_validator(
+                SurnameValidator, EXTENDED_ALPHABET,
+                validation_exception_type=ValidationError, **kwargs)
+        get_validator(CachedValidator, phone_number_cache, **kwargs)
+    get_validator(
+            IdentityCodeModelValidator,
+            get_validator(
+                IdentityCodeValidator,
+                validation_exception_type=ValidationError))
+
+
+warm_validators()